@@ -1,6 +1,7 @@
 # Copyright 2012-2016 Jonathan Paugh and contributors
 # See COPYING for license details
-from agithub.base import API, ConnectionProperties, Client
+from agithub.base import (
+    API, Batch, ConnectionProperties, Client, Paginator, urlencode)
 
 
 class Facebook(API):
@@ -15,11 +16,84 @@ class Facebook(API):
     {u'data': {u'is_silhouette': False,
        u'url':
            u'https://fbcdn-profile-a.akamaihd.net/hprofile-ak-frc3/t1.0-1/p50x50/1377580_10152203108461729_809245696_n.png'}})
+
+    Lists are paginated with cursors. Pass paginate=True to get all the
+    pages at once, or stream=True as well to fetch them as you go
+
+    >>> status, friends = fb.me.friends.get(paginate=True, stream=True)
+
+    Many requests can be made in one round trip with a batch (see
+    FacebookBatch)
+
+    >>> with fb.batch(access_token=token) as batch:
+    ...     me = batch.me.get()
+    ...     friends = batch.me.friends.get()
+    >>> me.status, me.data
     """
     def __init__(self, *args, **kwargs):
         props = ConnectionProperties(
             api_url='graph.facebook.com',
             secure_http=True,
         )
+        kwargs.setdefault('paginator', FacebookPaginator())
         self.setClient(Client(*args, **kwargs))
         self.setConnectionProperties(props)
+
+    def batch(self, deadline=None, headers=None, **params):
+        """
+        Start a batch. The batch request must carry an access_token
+        (passed as a url parameter, like any other request).
+        """
+        return FacebookBatch(self.client, deadline, headers, **params)
+
+
+class FacebookPaginator(Paginator):
+    """
+    Graph API lists hold their items in 'data', and link to the next page
+    in 'paging'. Other bodies, e.g. single objects, are not listings.
+    """
+    def items(self, data):
+        if not isinstance(data, dict) or 'data' not in data:
+            return data
+        return data['data']
+
+    def next_url(self, client, url, data):
+        if not isinstance(data, dict):
+            return None
+        return data.get('paging', {}).get('next')
+
+
+class FacebookBatch(Batch):
+    """
+    Sends requests through the Graph API's batch requests, 50 at a time
+    """
+    limit = 50
+
+    def send_batch(self, requests):
+        batch = []
+        for request in requests:
+            call = {
+                'method': request.method,
+                'relative_url': request.url.lstrip('/'),
+            }
+            if request.body is not None:
+                if isinstance(request.body, dict):
+                    call['body'] = urlencode(request.body)
+                else:
+                    call['body'] = request.body
+            headers = [{'name': k, 'value': v}
+                       for k, v in request.headers.items()
+                       if k.lower() != 'content-type']
+            if headers:
+                call['headers'] = headers
+            batch.append(call)
+
+        status, data = self.post('/', {'batch': batch})
+        if status != 200 or type(data) is not list:
+            return self.fail(requests, status, data)
+        for request, result in zip(requests, data):
+            # Requests which timed out have a null result, and are left
+            # with a status of None
+            if result is not None:
+                request.status = result.get('code')
+                request.data = self.parse(result.get('body'))
@@ -2,11 +2,11 @@
 # See COPYING for license details
 import base64
 import time
-import re
 import logging
 
 from agithub.base import (
-    API, ConnectionProperties, Client, RequestBody, ResponseBody)
+    API, ConnectionProperties, Client, DeadlineExceeded, LinkPaginator,
+    PageLimit, RequestBody, as_retry)
 
 logger = logging.getLogger(__name__)
 
@@ -75,15 +75,53 @@ class GitHub(API):
 
 
 class GitHubClient(Client):
+    request_options = Client.request_options + (
+        'stop_when', 'max_items', 'max_pages')
+
     def __init__(self, username=None, password=None, token=None,
                  connection_properties=None, paginate=False,
-                 sleep_on_ratelimit=True):
-        super(GitHubClient, self).__init__()
+                 sleep_on_ratelimit=True, ssl_context=None, dns_cache=None,
+                 transport=None, timeout=None, object_cache=None,
+                 priority_lanes=None, priority='high', profiler=None,
+                 limiter=None, retry=None):
+        super(GitHubClient, self).__init__(
+            ssl_context=ssl_context, dns_cache=dns_cache,
+            transport=transport, timeout=timeout, paginator=LinkPaginator(),
+            limiter=limiter, retry=retry)
         self.paginate = paginate
         self.sleep_on_ratelimit = sleep_on_ratelimit
-
-    def request(self, method, url, bodyData, headers):
-        """Low-level networking. All HTTP-method methods call this"""
+        self.object_cache = object_cache
+        self.priority_lanes = priority_lanes
+        self.priority = priority
+        self.profiler = profiler
+
+    def request(self, method, url, bodyData, headers, stream=None,
+                paginate=None, timeout=None, deadline=None, retry=None,
+                stop_when=None, max_items=None, max_pages=None):
+        """Low-level networking. All HTTP-method methods call this
+
+        paginate overrides the client's setting for this request. Passing
+        any of stop_when, max_items or max_pages enables pagination, and
+        stops it early (see PageLimit).
+
+        The deadline also covers sleeping for the ratelimit: rather than
+        sleep past it, DeadlineExceeded is raised straight away.
+
+        If a page after the first fails for good, PaginationError is
+        raised, holding the items fetched so far and a Continuation."""
+        limit = PageLimit(stop_when, max_items, max_pages)
+        if paginate is None:
+            paginate = self.paginate or limit.limited()
+        return super(GitHubClient, self).request(
+            method, url, bodyData, headers, stream, paginate, timeout,
+            deadline, retry, limit)
+
+    def request_page(self, method, url, bodyData, headers, stream=None,
+                     timeout=None, deadline=None, retry=None):
+        """Request a single page, without following pagination links.
+        Without a retry, the client's own retry policy applies."""
+        if retry is None:
+            retry = as_retry(self.retry)
 
         headers = self._fix_headers(headers)
         url = self.prop.constructUrl(url)
@@ -94,54 +132,71 @@ class GitHubClient(Client):
             if 'content-type' in headers:
                 del headers['content-type']
 
+        # Immutable git objects are answered from the object cache
+        cache_key = None
+        if self.object_cache is not None and method == 'GET' and not stream:
+            cache_key = self.object_cache.key(url, headers)
+        if cache_key is not None:
+            data = self.object_cache.get(cache_key)
+            if data is not None:
+                self.headers = []
+                if self.profiler is not None:
+                    self.profiler.record(method, url, 200, [], None, 'cached')
+                return 200, data
+
         # TODO: Context manager
         requestBody = RequestBody(bodyData, headers)
 
         if self.sleep_on_ratelimit and self.no_ratelimit_remaining():
-            self.sleep_until_more_ratelimit()
+            self.sleep_until_more_ratelimit(deadline)
 
         while True:
-            conn = self.get_connection()
-            conn.request(method, url, requestBody.process(), headers)
-            response = conn.getresponse()
+            if self.priority_lanes is not None:
+                lane = self.priority_lanes.enter(self.priority, deadline)
+            response_headers = None
+            try:
+                conn, response, content = self.send(
+                    method, url, requestBody.process(), headers, stream,
+                    timeout, deadline, retry)
+                response_headers = response.getheaders()
+            finally:
+                if self.priority_lanes is not None:
+                    # A request which failed still leaves its lane, without
+                    # news of the quota
+                    self.priority_lanes.leave(
+                        self.priority, lane, response_headers)
             status = response.status
-            content = ResponseBody(response)
-            self.headers = response.getheaders()
+            self.headers = response_headers
+            if self.profiler is not None:
+                size = response.getheader('Content-Length')
+                if content.body is not None:
+                    size = len(content.body)
+                self.profiler.record(
+                    method, url, status, self.headers,
+                    int(size) if size is not None else None,
+                    'not-modified' if status == 304 else 'fetched')
 
-            conn.close()
             if (status == 403 and self.sleep_on_ratelimit and
                     self.no_ratelimit_remaining()):
-                self.sleep_until_more_ratelimit()
+                conn.close()
+                self.sleep_until_more_ratelimit(deadline)
+            elif content.stream:
+                return status, self._close_after(content.processBody(), conn)
             else:
+                conn.close()
                 data = content.processBody()
-                if self.paginate and type(data) is list:
-                    data.extend(
-                        self.get_additional_pages(method, bodyData, headers))
+                if cache_key is not None and status == 200:
+                    self.object_cache.set(cache_key, data)
                 return status, data
 
-    def get_additional_pages(self, method, bodyData, headers):
-        data = []
-        url = self.get_next_link_url()
-        if not url:
-            return data
-        logger.debug(
-            'Fetching an additional paginated GitHub response page at '
-            '{}'.format(url))
-
-        status, data = self.request(method, url, bodyData, headers)
-        if type(data) is list:
-            data.extend(self.get_additional_pages(method, bodyData, headers))
-            return data
-        elif (status == 403 and self.no_ratelimit_remaining()
-              and not self.sleep_on_ratelimit):
-            raise TypeError(
+    def _page_error(self, status, data):
+        if (status == 403 and self.no_ratelimit_remaining()
+                and not self.sleep_on_ratelimit):
+            return (
                 'While fetching paginated GitHub response pages, the GitHub '
                 'ratelimit was reached but sleep_on_ratelimit is disabled. '
                 'Either enable sleep_on_ratelimit or disable paginate.')
-        else:
-            raise TypeError(
-                'While fetching a paginated GitHub response page, a non-list '
-                'was returned with status {}: {}'.format(status, data))
+        return super(GitHubClient, self)._page_error(status, data)
 
     def no_ratelimit_remaining(self):
         headers = dict(self.headers if self.headers is not None else [])
@@ -154,7 +209,13 @@ class GitHubClient(Client):
             'X-RateLimit-Reset', 0))
         return max(0, int(ratelimit_reset - time.time()) + 1)
 
-    def sleep_until_more_ratelimit(self):
+    def sleep_until_more_ratelimit(self, deadline=None):
+        if (deadline is not None and
+                deadline.remaining() < self.ratelimit_seconds_remaining()):
+            raise DeadlineExceeded(
+                'No GitHub ratelimit remaining until {} seconds after the '
+                'deadline'.format(int(self.ratelimit_seconds_remaining()
+                                      - deadline.remaining())))
         logger.debug(
             'No GitHub ratelimit remaining. Sleeping for {} seconds until {} '
             'before trying API call again.'.format(
@@ -164,32 +225,3 @@ class GitHubClient(Client):
                         time.time() + self.ratelimit_seconds_remaining()))
             ))
         time.sleep(self.ratelimit_seconds_remaining())
-
-    def get_next_link_url(self):
-        """Given a set of HTTP headers find the RFC 5988 Link header field,
-        determine if it contains a relation type indicating a next resource and
-        if so return the URL of the next resource, otherwise return an empty
-        string.
-
-        From https://github.com/requests/requests/blob/master/requests/utils.py
-        """
-        for value in [x[1] for x in self.headers if x[0].lower() == 'link']:
-            replace_chars = ' \'"'
-            value = value.strip(replace_chars)
-            if not value:
-                return ''
-            for val in re.split(', *<', value):
-                try:
-                    url, params = val.split(';', 1)
-                except ValueError:
-                    url, params = val, ''
-                link = {'url': url.strip('<> \'"')}
-                for param in params.split(';'):
-                    try:
-                        key, value = param.split('=')
-                    except ValueError:
-                        break
-                    link[key.strip(replace_chars)] = value.strip(replace_chars)
-                if link.get('rel') == 'next':
-                    return link['url']
-        return ''
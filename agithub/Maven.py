@@ -1,11 +1,17 @@
 # Copyright 2012-2016 Jonathan Paugh and contributors
 # See COPYING for license details
-from agithub.base import API, Client, ConnectionProperties
+from agithub.base import API, Client, ConnectionProperties, OffsetPaginator
 
 
 class Maven(API):
     """
     Maven Search API
+
+    Pass paginate=True to get all the results of a search at once; the
+    pages are fetched a few at a time, in parallel
+
+    >>> m = Maven()
+    >>> status, docs = m.select.get(q='guice', rows=100, paginate=True)
     """
     def __init__(self, *args, **kwargs):
         props = ConnectionProperties(
@@ -13,5 +19,29 @@ class Maven(API):
             url_prefix='/solrsearch',
             secure_http=True,
         )
+        kwargs.setdefault('paginator', MavenPaginator())
         self.setClient(Client(*args, **kwargs))
         self.setConnectionProperties(props)
+
+
+class MavenPaginator(OffsetPaginator):
+    """
+    Solr pages through results with the start and rows parameters, and
+    tells the total number of results in numFound. Other bodies are not
+    listings.
+    """
+    offset = 'start'
+    limit = 'rows'
+    default_limit = 20
+
+    def items(self, data):
+        if (not isinstance(data, dict)
+                or not isinstance(data.get('response'), dict)
+                or 'docs' not in data['response']):
+            return data
+        return data['response']['docs']
+
+    def total(self, data):
+        if not isinstance(data, dict):
+            return 0
+        return data.get('response', {}).get('numFound', 0)
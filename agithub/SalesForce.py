@@ -1,6 +1,7 @@
 # Copyright 2012-2016 Jonathan Paugh and contributors
 # See COPYING for license details
-from agithub.base import API, ConnectionProperties, Client
+from agithub.base import (
+    API, Batch, ConnectionProperties, Client, Paginator)
 
 
 class SalesForce(API):
@@ -30,11 +31,128 @@ class SalesForce(API):
 
     NB: XML is not automically decoded or de-serialized. Patch the
     ResponseBody class to fix this.
+
+    Query results come in batches. Pass paginate=True to get all the
+    records at once, or stream=True as well to fetch them as you go
+
+    >>> status, records = sf.services.data['v30.0'].query.get(
+    ...     q='SELECT Name FROM Account', paginate=True)
+
+    Many requests can be made in one round trip with a batch (see
+    SalesForceBatch)
+
+    >>> with sf.batch('v30.0', headers={'authorization': auth}) as batch:
+    ...     account = batch.services.data['v30.0'].sobjects.Account[id].get()
+    >>> account.status, account.data
     """
     def __init__(self, *args, **kwargs):
         props = ConnectionProperties(
             api_url='na1.salesforce.com',
             secure_http=True,
         )
+        kwargs.setdefault('paginator', SalesForcePaginator())
         self.setClient(Client(*args, **kwargs))
         self.setConnectionProperties(props)
+
+    def batch(self, version, kind='composite', deadline=None, headers=None,
+              **params):
+        """
+        Start a batch. Pass the authorization header in headers, as for any
+        other request.
+        """
+        return SalesForceBatch(
+            self.client, version, kind, deadline, headers, **params)
+
+
+class SalesForcePaginator(Paginator):
+    """
+    Query results hold their items in 'records', and, until 'done', the
+    path of the next batch in 'nextRecordsUrl'. Other bodies are not
+    listings.
+    """
+    def items(self, data):
+        if not isinstance(data, dict) or 'records' not in data:
+            return data
+        return data['records']
+
+    def next_url(self, client, url, data):
+        if not isinstance(data, dict) or data.get('done', True):
+            return None
+        return data.get('nextRecordsUrl')
+
+
+class SalesForceBatch(Batch):
+    """
+    Sends requests through the /composite resource of API version
+    version, 25 at a time. With kind='batch', /composite/batch is used
+    instead, which is limited to independent requests, but does not count
+    them against the composite limits.
+
+    Requests are given with their full path, starting at /services/data.
+    """
+    limit = 25
+    data_path = '/services/data/'
+
+    def __init__(self, client, version, kind='composite', deadline=None,
+                 headers=None, **params):
+        super(SalesForceBatch, self).__init__(
+            client, deadline, headers, **params)
+        self.version = version
+        self.kind = kind
+
+    def send_batch(self, requests):
+        if self.kind == 'batch':
+            self.send_composite_batch(requests)
+        else:
+            self.send_composite(requests)
+
+    def send_composite(self, requests):
+        composite = []
+        for n, request in enumerate(requests):
+            call = {
+                'method': request.method,
+                'url': request.url,
+                'referenceId': 'request%d' % n,
+            }
+            if request.body is not None:
+                call['body'] = request.body
+            headers = self.call_headers(request)
+            if headers:
+                call['httpHeaders'] = headers
+            composite.append(call)
+
+        status, data = self.post(
+            self.data_path + self.version + '/composite',
+            {'allOrNone': False, 'compositeRequest': composite})
+        if status != 200 or 'compositeResponse' not in data:
+            return self.fail(requests, status, data)
+        results = dict(
+            (r['referenceId'], r) for r in data['compositeResponse'])
+        for n, request in enumerate(requests):
+            result = results.get('request%d' % n, {})
+            request.status = result.get('httpStatusCode')
+            request.data = result.get('body')
+
+    def send_composite_batch(self, requests):
+        batch = []
+        for request in requests:
+            url = request.url
+            if url.startswith(self.data_path):
+                url = url[len(self.data_path):]
+            call = {'method': request.method, 'url': url}
+            if request.body is not None:
+                call['richInput'] = request.body
+            batch.append(call)
+
+        status, data = self.post(
+            self.data_path + self.version + '/composite/batch',
+            {'batchRequests': batch})
+        if status != 200 or 'results' not in data:
+            return self.fail(requests, status, data)
+        for request, result in zip(requests, data['results']):
+            request.status = result.get('statusCode')
+            request.data = result.get('result')
+
+    def call_headers(self, request):
+        return dict((k, v) for k, v in request.headers.items()
+                    if k.lower() != 'content-type')
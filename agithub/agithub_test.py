@@ -1,9 +1,47 @@
 #!/usr/bin/env python
 # Copyright 2012-2016 Jonathan Paugh and contributors
 # See COPYING for license details
+from agithub.Facebook import Facebook
 from agithub.GitHub import GitHub
-from agithub.base import IncompleteRequest
+from agithub.Maven import Maven
+from agithub.SalesForce import SalesForce
+from agithub import export
+from agithub.base import (
+    API, Client as BaseClient, ConnectionProperties, DeadlineExceeded,
+    DNSCache, IncompleteRequest, PaginationError, ResumingHTTPSConnection,
+    RetryPolicy, as_deadline)
+from agithub.crawler import Crawler, Level
+from agithub.download import Download, DownloadError
+from agithub.gitcache import GitObjectCache, GitObjectError, fetch_tree_blobs
+from agithub.limiter import AdaptiveLimiter
+from agithub.poller import Poller
+from agithub.priority import PriorityLanes
+from agithub.profiler import QuotaProfiler, endpoint
+from agithub.replay import Recorder, Replay
+from agithub.search import PartitionedSearch, SearchError, SearchRateLimit
+from agithub.sync import Sync, SyncError
+from agithub.writequeue import WriteQueue
+import datetime
+import email.utils
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import socket
+import threading
+import time
 import unittest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from urlparse import parse_qs, urlsplit
 
 
 class Client(object):
@@ -30,6 +68,87 @@ class Client(object):
         }
 
 
+class FakeResponse(object):
+    """
+    Stands in for an http.client.HTTPResponse. read1 hands out the body a
+    few bytes at a time, so tests can see how much of it was consumed.
+    """
+    def __init__(self, status=200, body=b'', headers=None, chunk_size=8):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.status = status
+        self.body = body
+        self.offset = 0
+        self.chunk_size = chunk_size
+        self.headers = [('Content-Type', 'application/json; charset=utf-8')]
+        self.headers += list((headers or {}).items())
+
+    def read(self, amt=None):
+        if amt is None:
+            amt = len(self.body) - self.offset
+        data = self.body[self.offset:self.offset + amt]
+        self.offset += len(data)
+        return data
+
+    def read1(self, amt):
+        return self.read(min(amt, self.chunk_size))
+
+    def getheader(self, name, default=None):
+        for key, value in self.headers:
+            if key.lower() == name.lower():
+                return value
+        return default
+
+    def getheaders(self):
+        return self.headers
+
+
+class FakeConnection(object):
+    """
+    Stands in for an http.client.HTTPConnection, answering each request
+    with the next of a list of FakeResponses, with the FakeResponse for
+    its url in a dict, or with what a function of the url returns
+    """
+    def __init__(self, responses, requests):
+        self.responses = responses
+        self.requests = requests
+        self.closed = False
+
+    def request(self, method, url, body=None, headers=None):
+        self.url = url
+        self.requests.append((method, url, body, headers))
+
+    def getresponse(self):
+        if isinstance(self.responses, dict):
+            return self.responses[self.url]
+        if callable(self.responses):
+            return self.responses(self.url)
+        return self.responses.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+def fakeAPI(api, responses):
+    """
+    Make the connections of api answer with the given responses. The
+    requests sent are recorded in its `requests` attribute.
+    """
+    api.requests = []
+    api.connections = []
+
+    def get_connection(timeouts=(None, None)):
+        conn = FakeConnection(responses, api.requests)
+        api.connections.append(conn)
+        return conn
+    api.client.get_connection = get_connection
+    return api
+
+
+def fakeGitHub(responses, **kwargs):
+    return fakeAPI(GitHub(**kwargs), responses)
+
+
 class TestGitHubObjectCreation(unittest.TestCase):
     def test_user_pw(self):
         gh = GitHub('korfuri', '1234')
@@ -88,6 +207,1234 @@ class TestIncompleteRequest(unittest.TestCase):
         )
 
 
+class TestStreaming(unittest.TestCase):
+    def test_streamArray(self):
+        items = [{'id': n, 'title': 'issue %d' % n} for n in range(50)]
+        response = FakeResponse(body=items)
+        g = fakeGitHub([response])
+        status, data = g.repos.octocat.hello.issues.get(stream=True)
+        self.assertEqual(status, 200)
+        self.assertEqual(g.requests[0][1], '/repos/octocat/hello/issues')
+
+        self.assertEqual(next(data), items[0])
+        self.assertLess(response.offset, len(response.body) // 2)
+        self.assertEqual(list(data), items[1:])
+        self.assertTrue(g.connections[0].closed)
+
+    def test_streamSplitNumbers(self):
+        # Reads of three bytes split the numbers at '.' and at 'e'
+        response = FakeResponse(body=b'[1.5,2e3,-4]', chunk_size=3)
+        g = fakeGitHub([response])
+        status, data = g.numbers.get(stream=True)
+        self.assertEqual(list(data), [1.5, 2000.0, -4])
+
+    def test_streamPath(self):
+        tree = [{'path': 'file%d' % n, 'sha': '%040d' % n} for n in range(9)]
+        body = {'sha': 'abc', 'url': 'u', 'tree': tree, 'truncated': False}
+        g = fakeGitHub([FakeResponse(body=body)])
+        status, data = g.repos.o.r.git.trees.abc.get(
+            recursive=1, stream='tree')
+        self.assertEqual(list(data), tree)
+
+    def test_streamUnexpectedShape(self):
+        body = {'message': 'Not Found'}
+        g = fakeGitHub([FakeResponse(body=body)])
+        status, data = g.search.issues.get(q='x', stream='items')
+        self.assertEqual(list(data), [body])
+
+    def test_streamOnlySuccess(self):
+        # Errors and 304s are read as usual, and empty bodies hold nothing
+        body = {'message': 'Not Found'}
+        g = fakeGitHub([FakeResponse(404, body=body),
+                        FakeResponse(304, body=b''),
+                        FakeResponse(body=b'')])
+        self.assertEqual(g.a.get(stream=True), (404, body))
+        self.assertEqual(g.a.get(stream=True), (304, ''))
+        status, data = g.a.get(stream=True)
+        self.assertEqual(list(data), [])
+
+    def test_streamPaginated(self):
+        link = '<https://api.github.com/repos/o/r/issues?page=2>; rel="next"'
+        responses = [
+            FakeResponse(body=[1, 2], headers={'Link': link}),
+            FakeResponse(body=[3, 4]),
+        ]
+        g = fakeGitHub(responses, paginate=True)
+        status, data = g.repos.o.r.issues.get(stream=True)
+        self.assertEqual(len(g.requests), 1)
+        self.assertEqual(list(data), [1, 2, 3, 4])
+        self.assertEqual(len(g.requests), 2)
+
+
+class TestPageLimit(unittest.TestCase):
+    def pages(self, count=3, per_page=3):
+        responses = []
+        for n in range(count):
+            link = '<https://api.github.com/items?page=%d>; rel="next"' % (
+                n + 2)
+            headers = {'Link': link} if n + 1 < count else {}
+            body = list(range(n * per_page, (n + 1) * per_page))
+            responses.append(FakeResponse(body=body, headers=headers))
+        return responses
+
+    def test_stopWhen(self):
+        g = fakeGitHub(self.pages())
+        status, data = g.items.get(stop_when=lambda n: n >= 4)
+        self.assertEqual(data, [0, 1, 2, 3])
+        self.assertEqual(len(g.requests), 2)
+
+    def test_maxItems(self):
+        g = fakeGitHub(self.pages(), paginate=True)
+        status, data = g.items.get(max_items=3)
+        self.assertEqual(data, [0, 1, 2])
+        self.assertEqual(len(g.requests), 1)
+
+    def test_maxPages(self):
+        g = fakeGitHub(self.pages())
+        status, data = g.items.get(max_pages=2)
+        self.assertEqual(data, list(range(6)))
+        self.assertEqual(len(g.requests), 2)
+
+    def test_notAListing(self):
+        g = fakeGitHub([FakeResponse(body={'id': 1})], paginate=True)
+        self.assertEqual(g.items[1].get(), (200, {'id': 1}))
+
+        pages = self.pages(2)
+        pages[1] = FakeResponse(body={'message': 'gone'})
+        g = fakeGitHub(pages, paginate=True)
+        with self.assertRaises(PaginationError) as e:
+            g.items.get()
+        self.assertEqual(e.exception.partial, [0, 1, 2])
+
+    def test_stopWhenStreaming(self):
+        g = fakeGitHub(self.pages())
+        status, data = g.items.get(stream=True, stop_when=lambda n: n == 5)
+        self.assertEqual(list(data), [0, 1, 2, 3, 4])
+        self.assertEqual(len(g.requests), 2)
+        self.assertTrue(g.connections[1].closed)
+
+    def test_paginateAll(self):
+        g = fakeGitHub(self.pages(), paginate=True)
+        status, data = g.items.get()
+        self.assertEqual(data, list(range(9)))
+
+
+class TestPaginators(unittest.TestCase):
+    def test_facebook(self):
+        next_url = 'https://graph.facebook.com/me/friends?after=x'
+        fb = fakeAPI(Facebook(), [
+            FakeResponse(body={'data': [1, 2], 'paging': {'next': next_url}}),
+            FakeResponse(body={'data': [3], 'paging': {}}),
+        ])
+        self.assertEqual(fb.me.friends.get(paginate=True), (200, [1, 2, 3]))
+        self.assertEqual(fb.requests[1][1], next_url)
+
+    def test_salesForceLazy(self):
+        sf = fakeAPI(SalesForce(), [
+            FakeResponse(body={'records': [1], 'done': False,
+                               'nextRecordsUrl': '/q/01g-2000'}),
+            FakeResponse(body={'records': [2], 'done': True}),
+        ])
+        status, records = sf.q.get(paginate=True, stream=True)
+        self.assertEqual(next(records), 1)
+        self.assertEqual(len(sf.requests), 1)
+        self.assertEqual(list(records), [2])
+        self.assertEqual(sf.requests[1][1], '/q/01g-2000')
+
+    def test_mavenPrefetch(self):
+        def page(start):
+            return FakeResponse(body={'response': {
+                'numFound': 7, 'start': start,
+                'docs': list(range(start, min(start + 3, 7)))}})
+        m = fakeAPI(Maven(), {
+            '/solrsearch/select?q=g&rows=3': page(0),
+            '/solrsearch/select?q=g&rows=3&start=3': page(3),
+            '/solrsearch/select?q=g&rows=3&start=6': page(6),
+        })
+        status, docs = m.select.get(q='g', rows=3, paginate=True)
+        self.assertEqual(docs, list(range(7)))
+
+    def test_notAListing(self):
+        fb = fakeAPI(Facebook(), [FakeResponse(body={'id': '1'})])
+        self.assertEqual(fb.me.get(paginate=True), (200, {'id': '1'}))
+        sf = fakeAPI(SalesForce(), [FakeResponse(body=[{'version': '59.0'}])])
+        self.assertEqual(sf.services.data.get(paginate=True),
+                         (200, [{'version': '59.0'}]))
+        m = fakeAPI(Maven(), [FakeResponse(body={'error': 'bad query'})])
+        self.assertEqual(m.select.get(q='g', paginate=True),
+                         (200, {'error': 'bad query'}))
+
+    def test_firstPageFails(self):
+        sf = fakeAPI(SalesForce(), [FakeResponse(401, body=[{'e': 1}])])
+        self.assertEqual(sf.q.get(paginate=True), (401, [{'e': 1}]))
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.policy = RetryPolicy(retries=2, backoff=1)
+        self.policy.sleep = self.sleeps.append
+
+    def pages(self, *bodies):
+        responses = []
+        for n, body in enumerate(bodies):
+            link = '<https://api.github.com/items?page=%d>; rel="next"' % (
+                n + 2)
+            responses.append(FakeResponse(body=body, headers={
+                'Link': link} if n + 1 < len(bodies) else {}))
+        return responses
+
+    def test_retryPage(self):
+        # The second page fails with a 502, then a reset connection
+        responses = self.pages([1, 2], [3, 4])
+        responses[1:1] = [FakeResponse(502, body={}), None]
+
+        def respond(url):
+            response = responses.pop(0)
+            if response is None:
+                raise ConnectionResetError()
+            return response
+        g = fakeGitHub(respond, retry=self.policy)
+        self.assertEqual(g.items.get(paginate=True), (200, [1, 2, 3, 4]))
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertLessEqual(self.sleeps[1], 2)
+
+    def test_retryAfter(self):
+        g = fakeGitHub([FakeResponse(503, body={},
+                                     headers={'Retry-After': '7'}),
+                        FakeResponse(body={})], retry=self.policy)
+        self.assertEqual(g.a.get(), (200, {}))
+        self.assertEqual(self.sleeps, [7])
+
+    def test_retryAfterDate(self):
+        self.policy.retries = 1
+        self.policy.backoff = 0
+        later = email.utils.formatdate(time.time() + 60, usegmt=True)
+        g = fakeGitHub([FakeResponse(503, body={},
+                                     headers={'Retry-After': later}),
+                        FakeResponse(body={})], retry=self.policy)
+        self.assertEqual(g.a.get(), (200, {}))
+        self.assertGreater(self.sleeps[0], 50)
+
+    def test_helpers(self):
+        # Helpers which request single pages use the client's policy too
+        g = fakeGitHub([FakeResponse(502, body={}),
+                        FakeResponse(body=[{'id': 1}])], retry=self.policy)
+        self.assertEqual(list(Sync().items(g.repos.o.r.issues)), [{'id': 1}])
+
+        g = fakeGitHub([FakeResponse(502, body={}),
+                        FakeResponse(body=[{'full_name': 'o/a'}])],
+                       retry=self.policy)
+        crawler = Crawler(g, Level('repo', '/orgs/{org}/repos'))
+        self.assertEqual([r.item for r in crawler.run(org='o')],
+                         [{'full_name': 'o/a'}])
+        self.assertEqual(crawler.failures, [])
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_notIdempotent(self):
+        g = fakeGitHub([FakeResponse(502, body={})], retry=self.policy)
+        self.assertEqual(g.a.post(body={}), (502, {}))
+        self.assertEqual(self.sleeps, [])
+
+    def test_exhausted(self):
+        responses = self.pages([1, 2], [3, 4]) + [
+            FakeResponse(502, body={}) for _ in range(3)]
+        g = fakeGitHub(responses[:1] + responses[2:], retry=self.policy)
+        with self.assertRaises(PaginationError) as e:
+            g.items.get(paginate=True)
+        self.assertEqual(e.exception.status, 502)
+        self.assertEqual(e.exception.partial, [1, 2])
+        self.assertEqual(len(g.requests), 4)
+
+        # Pick up where it stopped
+        continuation = e.exception.continuation
+        self.assertEqual(continuation.url,
+                         'https://api.github.com/items?page=2')
+        responses[1].offset = 0
+        g.client.get_connection = lambda timeouts: FakeConnection(
+            [responses[1]], g.requests)
+        self.assertEqual(continuation.resume(), (200, [3, 4]))
+
+    def test_prefetchExhausted(self):
+        def page(start):
+            return FakeResponse(body={'response': {
+                'numFound': 7, 'start': start,
+                'docs': list(range(start, min(start + 3, 7)))}})
+        m = fakeAPI(Maven(), {
+            '/solrsearch/select?q=g&rows=3': page(0),
+            '/solrsearch/select?q=g&rows=3&start=3': page(3),
+            '/solrsearch/select?q=g&rows=3&start=6': FakeResponse(
+                500, body={}),
+        })
+        with self.assertRaises(PaginationError) as e:
+            m.select.get(q='g', rows=3, paginate=True)
+        self.assertEqual(e.exception.partial, list(range(6)))
+        self.assertEqual(e.exception.continuation.url,
+                         '/select?q=g&rows=3&start=6')
+
+
+class TestBatch(unittest.TestCase):
+    def test_facebook(self):
+        def results(*codes):
+            return FakeResponse(body=[
+                {'code': code, 'body': json.dumps({'code': code})}
+                for code in codes])
+        fb = fakeAPI(Facebook(), [results(200, 404), results(200)])
+        with fb.batch(access_token='t') as batch:
+            batch.limit = 2
+            me = batch.me.get()
+            missing = batch.nobody.get(fields='id')
+            post = batch.me.feed.post(body={'message': 'hi'})
+        self.assertEqual((me.status, me.data), (200, {'code': 200}))
+        self.assertEqual(missing.status, 404)
+        self.assertEqual(post.status, 200)
+        self.assertEqual(len(fb.requests), 2)
+        self.assertEqual(fb.requests[0][1], '/?access_token=t')
+        sent = json.loads(fb.requests[0][2].decode('utf-8'))['batch']
+        self.assertEqual(sent[1]['relative_url'], 'nobody?fields=id')
+        sent = json.loads(fb.requests[1][2].decode('utf-8'))['batch']
+        self.assertEqual(sent[0]['body'], 'message=hi')
+
+    def test_salesForceComposite(self):
+        sf = fakeAPI(SalesForce(), [FakeResponse(body={'compositeResponse': [
+            {'referenceId': 'request1', 'httpStatusCode': 201,
+             'body': {'id': 'b'}},
+            {'referenceId': 'request0', 'httpStatusCode': 200,
+             'body': {'Name': 'a'}},
+        ]})])
+        with sf.batch('v30.0', headers={'Authorization': 'Bearer t'}) \
+                as batch:
+            sobjects = batch.services.data['v30.0'].sobjects
+            get = sobjects.Account.a.get()
+            post = sobjects.Account.post(body={'Name': 'b'})
+        self.assertEqual((get.status, get.data), (200, {'Name': 'a'}))
+        self.assertEqual((post.status, post.data), (201, {'id': 'b'}))
+        self.assertEqual(sf.requests[0][1], '/services/data/v30.0/composite')
+        self.assertEqual(sf.requests[0][3]['authorization'], 'Bearer t')
+
+    def test_failedBatch(self):
+        sf = fakeAPI(SalesForce(), [FakeResponse(401, body=[{'e': 'x'}])])
+        with sf.batch('v30.0', kind='batch') as batch:
+            get = batch.services.data['v30.0'].limits.get()
+        self.assertEqual((get.status, get.data), (401, [{'e': 'x'}]))
+
+
+class TestPartitionedSearch(unittest.TestCase):
+    def setUp(self):
+        start = datetime.datetime(2015, 1, 1)
+        self.issues = [
+            {'id': n, 'created_at': (start + datetime.timedelta(hours=n))
+             .strftime('%Y-%m-%dT%H:%M:%SZ')}
+            for n in range(2500)]
+
+    def search(self, url):
+        # Answers like the GitHub search API, for the created: qualifier
+        params = parse_qs(urlsplit(url).query)
+        start, end = re.search(
+            r'created:(\S+)\.\.(\S+)', params['q'][0]).groups()
+        found = [i for i in self.issues if start <= i['created_at'] <= end]
+        per_page = int(params['per_page'][0])
+        page = int(params.get('page', ['1'])[0])
+        headers = {}
+        if page * per_page < min(len(found), 1000):
+            headers['Link'] = '<%s&page=%d>; rel="next"' % (
+                url.split('&page=')[0], page + 1)
+        return FakeResponse(body={
+            'total_count': len(found),
+            'items': found[(page - 1) * per_page:page * per_page],
+        }, headers=headers)
+
+    def test_partition(self):
+        g = fakeGitHub(self.search)
+        search = PartitionedSearch(g.search.issues, 'is:issue',
+                                   start=datetime.datetime(2014, 1, 1),
+                                   end=datetime.datetime(2016, 1, 1))
+        items = search.run()
+        self.assertEqual(sorted(i['id'] for i in items), list(range(2500)))
+        self.assertEqual(search.truncated, [])
+
+    def test_error(self):
+        g = fakeGitHub([FakeResponse(422, body={'message': 'Invalid'})])
+        search = PartitionedSearch(g.search.issues, 'is:issue', workers=1)
+        with self.assertRaises(SearchError) as e:
+            search.run()
+        self.assertEqual(e.exception.status, 422)
+        self.assertEqual(e.exception.data, {'message': 'Invalid'})
+
+    def test_sharedRateLimit(self):
+        limit = SearchRateLimit()
+        clock = FakeClock()
+        limit.clock, limit.sleep = clock.time, clock.sleep
+        g = fakeGitHub([FakeResponse(headers={
+            'X-RateLimit-Resource': 'search',
+            'X-RateLimit-Remaining': '1',
+            'X-RateLimit-Reset': '1030'})])
+        g.search.issues.get()
+        limit.update(g.client)
+        limit.acquire()
+        self.assertEqual(clock.sleeps, [])
+        limit.acquire()
+        self.assertEqual(clock.sleeps, [31])
+        limit.acquire()
+        self.assertEqual(clock.sleeps, [31])
+
+
+class TestSync(unittest.TestCase):
+    link = '<https://api.github.com/repos/o/r/issues?page=2>; rel="next"'
+
+    def pages(self):
+        return [
+            FakeResponse(
+                body=[{'id': 1, 'updated_at': '2020-01-02T00:00:00Z'}],
+                headers={'Link': self.link, 'ETag': '"one"'}),
+            FakeResponse(
+                body=[{'id': 2, 'updated_at': '2020-01-01T00:00:00Z'}]),
+        ]
+
+    def test_sinceAndETag(self):
+        sync = Sync()
+        g = fakeGitHub(self.pages())
+        items = list(sync.items(g.repos.o.r.issues, state='all'))
+        self.assertEqual([i['id'] for i in items], [1, 2])
+        checkpoint = sync.store.get('/repos/o/r/issues')
+        self.assertEqual(checkpoint['since'], '2020-01-02T00:00:00Z')
+        self.assertIsNone(checkpoint['next_url'])
+
+        g = fakeGitHub([FakeResponse(body=[], headers={'ETag': '"two"'}),
+                        FakeResponse(304, body=b'')])
+        self.assertEqual(list(sync.items(g.repos.o.r.issues, state='all')),
+                         [])
+        self.assertIn('since=2020-01-02T00', g.requests[0][1])
+        self.assertEqual(list(sync.items(g.repos.o.r.issues, state='all')),
+                         [])
+        self.assertEqual(g.requests[1][3]['if-none-match'], '"two"')
+
+    def test_resume(self):
+        sync = Sync()
+        responses = self.pages()
+        responses[1] = FakeResponse(502, body={'message': 'Bad Gateway'})
+        g = fakeGitHub(responses)
+        with self.assertRaises(SyncError):
+            list(sync.items(g.repos.o.r.issues))
+
+        g = fakeGitHub(self.pages()[1:])
+        items = list(sync.items(g.repos.o.r.issues))
+        self.assertEqual([i['id'] for i in items], [2])
+        self.assertEqual(g.requests[0][1],
+                         'https://api.github.com/repos/o/r/issues?page=2')
+        checkpoint = sync.store.get('/repos/o/r/issues')
+        self.assertEqual(checkpoint['since'], '2020-01-02T00:00:00Z')
+
+    def test_sinceCappedAtStart(self):
+        sync = Sync()
+        responses = self.pages()
+        responses[0].headers.append(('Date', 'Wed, 01 Jan 2020 12:00:00 GMT'))
+        g = fakeGitHub(responses)
+        list(sync.items(g.repos.o.r.issues))
+        checkpoint = sync.store.get('/repos/o/r/issues')
+        self.assertEqual(checkpoint['started'], '2020-01-01T12:00:00Z')
+        self.assertEqual(checkpoint['since'], '2020-01-01T12:00:00Z')
+
+
+class TestPoller(unittest.TestCase):
+    def test_newEventsOnly(self):
+        first = [{'id': '3'}, {'id': '2'}]
+        responses = [
+            FakeResponse(body=first, headers={
+                'ETag': '"a"', 'X-Poll-Interval': '90'}),
+            FakeResponse(304, body=b''),
+            FakeResponse(body=[{'id': '5'}, {'id': '4'}], headers={
+                'ETag': '"b"',
+                'Link': '<https://api.github.com/events?page=2>; rel="next"'
+            }),
+            FakeResponse(body=[{'id': '3'}, {'id': '2'}]),
+        ]
+        g = fakeGitHub(responses)
+        poller = Poller(g)
+        delivered = []
+        feed = poller.watch(g.repos.o.r.events, delivered.append)
+
+        poller.poll(feed)
+        self.assertEqual(delivered, [{'id': '2'}, {'id': '3'}])
+        self.assertEqual(feed.interval, 90)
+
+        self.assertEqual(poller.poll(feed), [])
+        self.assertEqual(g.requests[1][3]['if-none-match'], '"a"')
+
+        poller.poll(feed)
+        self.assertEqual([e['id'] for e in delivered], ['2', '3', '4', '5'])
+        self.assertEqual(len(g.requests), 4)
+        self.assertEqual(feed.etag, '"b"')
+
+    def test_failedPageRetried(self):
+        link = '<https://api.github.com/events?page=2>; rel="next"'
+        responses = [
+            FakeResponse(body=[{'id': '1'}], headers={'ETag': '"a"'}),
+            FakeResponse(body=[{'id': '3'}, {'id': '2'}],
+                         headers={'ETag': '"b"', 'Link': link}),
+            FakeResponse(502, body={}),
+            FakeResponse(body=[{'id': '3'}, {'id': '2'}],
+                         headers={'ETag': '"b"', 'Link': link}),
+            FakeResponse(body=[{'id': '1'}]),
+        ]
+        g = fakeGitHub(responses)
+        poller = Poller(g)
+        delivered = []
+        feed = poller.watch(g.events, delivered.append)
+        poller.poll(feed)
+        with self.assertRaises(TypeError):
+            poller.poll(feed)
+        # Nothing was learnt from the failed poll
+        self.assertEqual(feed.etag, '"a"')
+        poller.poll(feed)
+        self.assertEqual(g.requests[3][3]['if-none-match'], '"a"')
+        self.assertEqual([e['id'] for e in delivered], ['1', '2', '3'])
+
+    def test_pollDue(self):
+        g = fakeGitHub([FakeResponse(body=[{'id': '1'}])])
+        poller = Poller(g, interval=60)
+        delivered = []
+        poller.watch(g.events, delivered.append)
+        wait = poller.poll_due()
+        self.assertEqual(delivered, [{'id': '1'}])
+        self.assertGreater(wait, 50)
+
+
+class CountingDNSCache(DNSCache):
+    lookups = 0
+
+    def lookup(self, host, port):
+        self.lookups += 1
+        return [(None, None, None, '', ('127.0.0.1', port))]
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """
+    Runs an HTTP server on localhost, which answers GET requests with
+    their path, as JSON; after a pause, if the path starts with /slow
+    """
+    def handler(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/slow'):
+                    time.sleep(0.5)
+                body = json.dumps({'path': self.path}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), self.handler())
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def api(self, host='127.0.0.1', **kwargs):
+        api = API.__new__(API)
+        api.setClient(BaseClient(**kwargs))
+        api.setConnectionProperties(ConnectionProperties(
+            api_url='%s:%d' % (host, self.server.server_port),
+            secure_http=False))
+        return api
+
+
+class TestConnectionSetup(LocalServerTestCase):
+    def test_dnsCache(self):
+        cache = CountingDNSCache(ttl=60)
+        api = self.api('cached.invalid', dns_cache=cache)
+        self.assertEqual(api.a.get(), (200, {'path': '/a'}))
+        self.assertEqual(api.b.get(), (200, {'path': '/b'}))
+        self.assertEqual(cache.lookups, 1)
+
+        cache.ttl = -1
+        cache.cache.clear()
+        api.a.get()
+        api.a.get()
+        self.assertEqual(cache.lookups, 3)
+
+    def test_dnsPin(self):
+        cache = CountingDNSCache(pin={'pinned.invalid': '127.0.0.1'})
+        api = self.api('pinned.invalid', dns_cache=cache)
+        self.assertEqual(api.a.get(), (200, {'path': '/a'}))
+        self.assertEqual(cache.lookups, 0)
+
+    def test_sharedSSLContext(self):
+        a, b = GitHub().client, GitHub().client
+        conn_a, conn_b = a.get_connection(), b.get_connection()
+        self.assertIsInstance(conn_a, ResumingHTTPSConnection)
+        self.assertIs(conn_a._context, conn_b._context)
+        self.assertIs(conn_a.tls_sessions, a.tls_sessions)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestWriteQueue(unittest.TestCase):
+    def queue(self, g, **kwargs):
+        queue = WriteQueue(g, **kwargs)
+        queue.clock = FakeClock()
+        queue.clock, queue.sleep = queue.clock.time, queue.clock.sleep
+        return queue
+
+    def test_merge(self):
+        g = fakeGitHub([FakeResponse(body={}), FakeResponse(body={})])
+        queue = self.queue(g)
+        first = queue.patch(g.repos.o.r.issues[1], body={'state': 'closed'})
+        second = queue.patch(g.repos.o.r.issues[1], body={'title': 'x'})
+        queue.put(g.repos.o.r.issues[2].lock)
+        queue.delete(g.repos.o.r.issues[2].lock)
+        self.assertIs(first, second)
+        writes = queue.run()
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(json.loads(g.requests[0][2].decode('utf-8')),
+                         {'state': 'closed', 'title': 'x'})
+        self.assertEqual(g.requests[1][0], 'DELETE')
+
+    def test_rateAndBackoff(self):
+        limited = FakeResponse(403, body={
+            'message': 'You have exceeded a secondary rate limit.'})
+        g = fakeGitHub([FakeResponse(body={}), limited,
+                        FakeResponse(body={}), FakeResponse(body={})])
+        queue = self.queue(g, per_minute=2, interval=1)
+        for n in range(3):
+            queue.post(g.repos.o.r.issues[n].comments, body={'body': 'hi'})
+        writes = queue.run()
+        self.assertEqual([w.status for w in writes], [200, 200, 200])
+        self.assertEqual(len(g.requests), 4)
+        # Spaced by interval, then paused by the backoff, then spaced by
+        # the doubled interval, shrunk again after a success
+        sleeps = [round(s, 3) for s in queue.sleep.__self__.sleeps]
+        self.assertEqual(sleeps, [1, 60, 1.8])
+
+    def test_failure(self):
+        responses = [FakeResponse(body={}), None, FakeResponse(body={}),
+                     FakeResponse(403, body={}, headers={
+                         'Retry-After': 'Thu, 01 Jan 1970 00:17:00 GMT'}),
+                     FakeResponse(body={})]
+
+        def respond(url):
+            response = responses.pop(0)
+            if response is None:
+                raise ConnectionResetError()
+            return response
+        g = fakeGitHub(respond)
+        queue = self.queue(g, interval=0)
+        writes = [queue.patch(g.repos.o.r.issues[n], body={'state': 'closed'})
+                  for n in range(4)]
+        finished = queue.run()
+        self.assertEqual(len(finished), 4)
+        self.assertEqual([w.status for w in writes],
+                         [200, 'failed', 200, 200])
+        self.assertIsInstance(writes[1].error, ConnectionResetError)
+        self.assertTrue(all(w.done.is_set() for w in writes))
+        # Retry-After as a date: the clock is at 1000s past the epoch
+        self.assertEqual(queue.sleep.__self__.sleeps, [20])
+
+    def test_perMinute(self):
+        g = fakeGitHub([FakeResponse(body={}) for n in range(3)])
+        queue = self.queue(g, per_minute=2, interval=0)
+        for n in range(3):
+            queue.post(g.repos.o.r.issues[n].comments, body={'body': 'hi'})
+        queue.run()
+        self.assertEqual(queue.sleep.__self__.sleeps, [60])
+
+
+class TestTimeouts(LocalServerTestCase):
+    def test_clientTimeout(self):
+        api = self.api(timeout=0.1)
+        self.assertEqual(api.fast.get(), (200, {'path': '/fast'}))
+        with self.assertRaises(socket.timeout):
+            api.slow.get()
+
+    def test_requestTimeout(self):
+        api = self.api(timeout=(5, 5))
+        with self.assertRaises(socket.timeout):
+            api.slow.get(timeout=0.1)
+
+    def test_deadline(self):
+        api = self.api()
+        with self.assertRaises(DeadlineExceeded):
+            api.slow.get(deadline=0.1)
+
+    def test_ratelimitSleepPastDeadline(self):
+        link = '<https://api.github.com/items?page=2>; rel="next"'
+        g = fakeGitHub([FakeResponse(body=[1, 2], headers={
+            'Link': link,
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(int(time.time()) + 3600),
+        })])
+        with self.assertRaises(DeadlineExceeded) as context:
+            g.items.get(paginate=True, deadline=60)
+        self.assertEqual(context.exception.partial, [1, 2])
+
+
+class TestDownload(LocalServerTestCase):
+    """
+    The server redirects /asset to /blob on another host name, which
+    serves ranges of content
+    """
+    content = bytes(bytearray(range(256))) * 40
+
+    # With expire_after, /asset redirects to a new signed url each time,
+    # which only serves that many requests
+    expire_after = None
+
+    def handler(self):
+        test = self
+        test.requests = []
+        test.signatures = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self.respond(head=True)
+
+            def do_GET(self):
+                self.respond()
+
+            def respond(self, head=False):
+                test.requests.append((self.command, self.path, dict(
+                    (k.lower(), v) for k, v in self.headers.items())))
+                if self.path == '/asset':
+                    location = 'http://localhost:%d/blob' % (
+                        test.server.server_port)
+                    if test.expire_after is not None:
+                        test.signatures.append(0)
+                        location += '?sig=%d' % (len(test.signatures) - 1)
+                    self.send_response(302)
+                    self.send_header('Location', location)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path.startswith('/blob?sig='):
+                    sig = int(self.path.split('=')[1])
+                    test.signatures[sig] += 1
+                    if test.signatures[sig] > test.expire_after:
+                        self.send_response(403)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.path = '/blob'
+                body = test.content
+                ranged = self.path == '/blob' and self.headers['Range']
+                if ranged:
+                    start, end = ranged[len('bytes='):].split('-')
+                    body = body[int(start):int(end) + 1]
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %s-%s/%d' % (
+                        start, end, len(test.content)))
+                else:
+                    self.send_response(200)
+                if self.path == '/blob':
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('ETag', '"v1"')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body[:1000])
+                    self.wfile.write(body[1000:])
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    def setUp(self):
+        super(TestDownload, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'asset')
+        self.api = self.api()
+        self.api.client.default_headers['authorization'] = 'token secret'
+
+    def test_ranges(self):
+        digest = 'sha256:' + hashlib.sha256(self.content).hexdigest()
+        Download(self.api.asset, self.path, chunk_size=1000, workers=3,
+                 digest=digest).run()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(os.path.exists(self.path + '.partial.json'))
+
+        ranges = [r for r in self.requests if r[2].get('range')]
+        self.assertEqual(len(ranges), 11)
+        # The redirect is only followed once, and the credentials stay with
+        # the API's host
+        self.assertEqual(
+            [r[2].get('authorization') for r in self.requests
+             if r[1] == '/asset'], ['token secret'])
+        self.assertFalse(any('authorization' in r[2] for r in self.requests
+                             if r[1] == '/blob'))
+
+    def test_expiredUrl(self):
+        self.expire_after = 4
+        Download(self.api.asset, self.path, chunk_size=1000,
+                 workers=1).run()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        # The probe and three chunks, then twice four chunks
+        self.assertEqual(len(self.signatures), 3)
+
+    def test_resume(self):
+        download = Download(self.api.blob, self.path, chunk_size=4000)
+        # A previous attempt got the first two chunks
+        with open(self.path + '.partial', 'wb') as f:
+            f.write(self.content[:8000])
+            f.truncate(len(self.content))
+        download.save_state(dict(download.load_state(
+            len(self.content), '"v1"'), done=[0, 4000]))
+        download.run()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual([r[2].get('range') for r in self.requests
+                          if r[0] == 'GET'], ['bytes=8000-10239'])
+
+    def test_noRanges(self):
+        Download(self.api.whole, self.path).run()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_digestMismatch(self):
+        with self.assertRaises(DownloadError):
+            Download(self.api.blob, self.path, digest='0' * 64).run()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.partial'))
+
+
+class TestReplay(LocalServerTestCase):
+    def setUp(self):
+        super(TestReplay, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'traffic.jsonl.gz')
+
+    def tearDown(self):
+        super(TestReplay, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_recordAndReplay(self):
+        with Recorder(self.path) as recorder:
+            api = self.api(transport=recorder)
+            self.assertEqual(api.a.get(x=1), (200, {'path': '/a?x=1'}))
+            api.b.get()
+        self.server.shutdown()
+
+        replay = Replay(self.path)
+        api = self.api(transport=replay)
+        self.assertEqual(api.a.get(x=1), (200, {'path': '/a?x=1'}))
+        self.assertEqual(api.b.get(), (200, {'path': '/b'}))
+        self.assertEqual(api.a.get(x=1), (200, {'path': '/a?x=1'}))
+        with self.assertRaises(LookupError):
+            api.c.get()
+
+
+class TestGitObjectCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_permanent(self):
+        sha = 'a' * 40
+        blob = {'sha': sha, 'content': 'aGk='}
+        g = fakeGitHub([FakeResponse(body=blob)],
+                       object_cache=GitObjectCache(self.tmpdir))
+        for n in range(2):
+            self.assertEqual(g.repos.o.r.git.blobs[sha].get(), (200, blob))
+        self.assertEqual(len(g.requests), 1)
+
+        # Another process, sharing the directory
+        g = fakeGitHub([], object_cache=GitObjectCache(self.tmpdir))
+        self.assertEqual(g.repos.fork.r.git.blobs[sha].get(), (200, blob))
+        self.assertIsNone(g.client.object_cache.key(
+            '/repos/o/r/git/refs/heads/main', {}))
+
+    def test_copies(self):
+        sha = 'a' * 40
+        g = fakeGitHub([FakeResponse(body={'sha': sha})],
+                       object_cache=GitObjectCache())
+        status, blob = g.repos.o.r.git.blobs[sha].get()
+        blob['sha'] = 'changed'
+        status, blob = g.repos.o.r.git.blobs[sha].get()
+        blob['extra'] = True
+        self.assertEqual(g.repos.o.r.git.blobs[sha].get(), (200, {'sha': sha}))
+
+    def test_fetchTreeBlobs(self):
+        shas = dict((name, name[0] * 40) for name in ('a.txt', 'b.txt'))
+        tree = {'truncated': False, 'tree': [
+            {'path': 'a.txt', 'type': 'blob', 'sha': shas['a.txt']},
+            {'path': 'dir', 'type': 'tree', 'sha': 'd' * 40},
+            {'path': 'dir/b.txt', 'type': 'blob', 'sha': shas['b.txt']},
+        ]}
+        cache = GitObjectCache()
+        responses = {
+            '/repos/o/r/git/trees/%s?recursive=1' % ('t' * 40):
+                FakeResponse(body=tree),
+            '/repos/o/r/git/blobs/' + shas['b.txt']:
+                FakeResponse(body={'sha': shas['b.txt']}),
+        }
+        g = fakeGitHub(responses, object_cache=cache)
+        cache.set(cache.key('/repos/o/r/git/blobs/' + shas['a.txt'],
+                            {'accept': 'application/vnd.github.v3+json'}),
+                  {'sha': shas['a.txt']})
+
+        blobs = fetch_tree_blobs(g, 'o', 'r', 't' * 40)
+        self.assertEqual(blobs, {
+            'a.txt': {'sha': shas['a.txt']},
+            'dir/b.txt': {'sha': shas['b.txt']},
+        })
+        self.assertEqual(len(g.requests), 2)
+
+    def test_fetchTreeBlobsFails(self):
+        g = fakeGitHub([FakeResponse(404, body={'message': 'Not Found'})])
+        with self.assertRaises(GitObjectError) as e:
+            fetch_tree_blobs(g, 'o', 'r', 't' * 40)
+        self.assertEqual((e.exception.sha, e.exception.status),
+                         ('t' * 40, 404))
+        self.assertEqual(e.exception.data, {'message': 'Not Found'})
+
+
+class TestPriorityLanes(unittest.TestCase):
+    def response(self, remaining):
+        return FakeResponse(body={}, headers={
+            'X-RateLimit-Limit': '100',
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': str(int(time.time()) + 3600),
+        })
+
+    def test_reserve(self):
+        lanes = PriorityLanes({'high': 0, 'low': 0.2})
+        responses = [self.response(21), self.response(20), self.response(19)]
+        low = fakeGitHub(responses, priority_lanes=lanes, priority='low')
+        high = fakeGitHub(responses, priority_lanes=lanes)
+        low.rate_limit.get()
+
+        # The low lane now only has its floor left, and must wait
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            lanes.reset = time.time() - 1
+        lanes.condition.wait = wait
+        high.rate_limit.get()
+        self.assertEqual(waits, [])
+        low.rate_limit.get()
+        self.assertEqual(len(waits), 1)
+        self.assertGreater(waits[0], 3000)
+
+        report = lanes.report()
+        self.assertEqual(report['high']['requests'], 1)
+        self.assertEqual(report['low']['requests'], 2)
+
+    def test_afterReset(self):
+        lanes = PriorityLanes({'high': 0, 'low': 0.5})
+        lanes.limit, lanes.remaining, lanes.reset = 4, 0, time.time() - 1
+        # Once reset, the quota is counted down again, floor included
+        self.assertTrue(lanes._may_send(0.5))
+        lanes.enter('low')
+        self.assertTrue(lanes._may_send(0.5))
+        lanes.enter('low')
+        self.assertFalse(lanes._may_send(0.5))
+
+    def test_failedRequest(self):
+        lanes = PriorityLanes()
+
+        def respond(url):
+            raise ConnectionResetError()
+        g = fakeGitHub(respond, priority_lanes=lanes)
+        with self.assertRaises(ConnectionResetError):
+            g.rate_limit.get()
+        self.assertEqual(lanes.report()['high']['requests'], 1)
+
+    def test_deadline(self):
+        lanes = PriorityLanes()
+        g = fakeGitHub([self.response(20)], priority_lanes=lanes,
+                       priority='low')
+        g.rate_limit.get()
+        with self.assertRaises(DeadlineExceeded):
+            g.rate_limit.get(deadline=60)
+
+
+class TestExport(unittest.TestCase):
+    items = [
+        {'id': 1, 'user': {'login': 'a'}, 'labels': ['bug'], 'score': 1},
+        {'id': 2, 'user': {'login': 'b'}, 'labels': [], 'score': 0.5,
+         'extra': True},
+        {'id': 3, 'user': None, 'labels': [], 'score': 2},
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_flatten(self):
+        self.assertEqual(
+            export.flatten({'user': {'login': 'a', 'site': {'id': 1}},
+                            'labels': [{'name': 'bug'}]}),
+            {'user.login': 'a', 'user.site.id': 1,
+             'labels': '[{"name": "bug"}]'})
+
+    def test_schema(self):
+        schema = export.Schema(
+            [export.flatten(item) for item in self.items[:2]])
+        self.assertEqual(schema.types, {
+            'id': 'int', 'user.login': 'str', 'labels': 'str',
+            'score': 'float', 'extra': 'bool'})
+        self.assertEqual(schema.column([{'score': 2}], 'score'), [2.0])
+        self.assertEqual(schema.column([{'id': 'x'}, {'id': 3}], 'id'),
+                         [None, 3])
+        schema = export.Schema([{'id': 1}], types={'id': 'str'})
+        self.assertEqual(schema.column([{'id': 'x'}, {'id': 3}], 'id'),
+                         ['x', '3'])
+
+    def test_ndjson(self):
+        path = os.path.join(self.dir, 'items.ndjson.gz')
+        count = export.export(iter(self.items), path, row_group_size=2)
+        self.assertEqual(count, 3)
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual([json.loads(line) for line in f], self.items)
+
+    def test_failure(self):
+        def items():
+            yield self.items[0]
+            raise TypeError('page failed')
+        path = os.path.join(self.dir, 'items.jsonl')
+        with self.assertRaises(TypeError):
+            export.export(items(), path)
+
+    def test_writerFails(self):
+        closed = []
+
+        def items():
+            try:
+                # Not serializable, so writing the first batch fails
+                yield {'n': object()}
+                while True:
+                    yield {'n': 1}
+            finally:
+                closed.append(True)
+        path = os.path.join(self.dir, 'items.jsonl')
+        threads = threading.active_count()
+        with self.assertRaises(TypeError):
+            export.export(items(), path, row_group_size=2)
+        self.assertEqual(closed, [True])
+        self.assertEqual(threading.active_count(), threads)
+
+    @unittest.skipIf(export.pyarrow is None, 'needs pyarrow')
+    def test_parquet(self):
+        path = os.path.join(self.dir, 'items.parquet')
+        export.export(self.items, path, row_group_size=2)
+        f = export.pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(f.num_row_groups, 2)
+        self.assertEqual(f.read().to_pydict()['user.login'], ['a', 'b', None])
+
+    @unittest.skipIf(export.pyarrow is None, 'needs pyarrow')
+    def test_arrow(self):
+        path = os.path.join(self.dir, 'items.arrow')
+        export.export(self.items, path, row_group_size=2)
+        table = export.pyarrow.ipc.open_file(path).read_all()
+        self.assertEqual(table.to_pydict()['score'], [1.0, 0.5, 2.0])
+
+
+class TestCrawler(unittest.TestCase):
+    def responses(self):
+        repo = 'https://api.github.com/repos/o/{}'
+        return {
+            '/orgs/o/repos?type=all': FakeResponse(
+                body=[{'full_name': 'o/a'}], headers={
+                    'Link': '</orgs/o/repos?page=2>; rel="next"'}),
+            '/orgs/o/repos?page=2': FakeResponse(
+                body=[{'full_name': 'o/b'}]),
+            '/repos/o/a/issues': FakeResponse(body=[
+                {'number': 1, 'comments': 0,
+                 'comments_url': repo.format('a/issues/1/comments')},
+                {'number': 2, 'comments': 1,
+                 'comments_url': repo.format('a/issues/2/comments{/id}')},
+            ]),
+            '/repos/o/b/issues': FakeResponse(status=410, body={}),
+            repo.format('a/issues/2/comments'): FakeResponse(
+                body=[{'id': 7}]),
+        }
+
+    def levels(self):
+        comments = Level('comment', '{comments_url}',
+                         when=lambda issue: issue['comments'] > 0)
+        return Level('repo', '/orgs/{org}/repos', params={'type': 'all'},
+                     children=[Level('issue', '/repos/{full_name}/issues',
+                                     children=[comments])])
+
+    def test_crawl(self):
+        g = fakeGitHub(self.responses())
+        crawler = Crawler(g, self.levels(), workers=3)
+        results = list(crawler.run(org='o'))
+        self.assertEqual(sorted(r.level for r in results),
+                         ['comment', 'issue', 'issue', 'repo', 'repo'])
+        comment = [r for r in results if r.level == 'comment'][0]
+        self.assertEqual(comment.item, {'id': 7})
+        self.assertEqual(comment.parent.item['number'], 2)
+        self.assertEqual(comment.parent.parent.item['full_name'], 'o/a')
+        self.assertEqual([f[:2] for f in crawler.failures],
+                         [('/repos/o/b/issues', 410)])
+        self.assertEqual(len(g.requests), 5)
+
+    def test_backpressure(self):
+        g = fakeGitHub(self.responses())
+        results = Crawler(g, self.levels(), workers=1, buffer=1).run(org='o')
+        self.assertEqual(next(results).level, 'repo')
+        time.sleep(0.2)
+        # With a buffer of one result, the worker waits for the consumer
+        # once it has the next repo and an issue in hand
+        self.assertEqual(len(g.requests), 3)
+        results.close()
+
+
+class TestQuotaProfiler(unittest.TestCase):
+    def test_endpoint(self):
+        self.assertEqual(endpoint('/repos/octocat/hello/issues/12?page=2'),
+                         '/repos/:owner/:repo/issues/:id')
+        self.assertEqual(endpoint('/users/octocat/repos'),
+                         '/users/:user/repos')
+        self.assertEqual(
+            endpoint('https://api.github.com/repos/o/r/contents/a/b.py'),
+            '/repos/:owner/:repo/contents/:path')
+        self.assertEqual(
+            endpoint('/repos/o/r/git/trees/' + '0a' * 20),
+            '/repos/:owner/:repo/git/trees/:sha')
+        self.assertEqual(endpoint('/orgs/mozilla/teams/core/members'),
+                         '/orgs/:org/teams/:team_slug/members')
+
+    def response(self, used, status=200):
+        return FakeResponse(status=status, body=[] if status == 200 else b'',
+                            headers={'X-RateLimit-Used': str(used),
+                                     'X-RateLimit-Reset': '1000'})
+
+    def test_report(self):
+        # This test module is part of the agithub package, so only the
+        # library modules count as internal
+        profiler = QuotaProfiler(internal=(
+            'agithub.base', 'agithub.GitHub', 'agithub.profiler'))
+        g = fakeGitHub([self.response(10), self.response(11),
+                        self.response(14), self.response(14, 304)],
+                       profiler=profiler)
+
+        def issues():
+            g.repos.o.a.issues.get()
+        issues()
+        g.repos.o.b.issues.get()
+        g.users.u.get()  # another user of the token spent 2 meanwhile
+        g.repos.o.b.issues.get(headers={'If-None-Match': '"x"'})
+
+        rows = profiler.report()
+        self.assertEqual(
+            [(r['key'], r['requests'], r['cost'], r['cached'])
+             for r in rows],
+            [('GET /users/:user', 1, 3, 0),
+             ('GET /repos/:owner/:repo/issues', 3, 2, 1)])
+        self.assertEqual(rows[1]['statuses'], {200: 2, 304: 1})
+        self.assertEqual(rows[1]['bytes'], 4)
+
+        sites = profiler.report(by='site')
+        self.assertEqual(len(sites), 4)
+        self.assertIn('in issues', profiler.records[0].site)
+        self.assertIn('in test_report', profiler.records[0].stack[1])
+
+    def test_keep(self):
+        profiler = QuotaProfiler(keep=2)
+        g = fakeGitHub([self.response(n) for n in range(1, 4)],
+                       profiler=profiler)
+        for n in range(3):
+            g.repos.o.r.issues.get()
+        self.assertEqual(len(profiler.records), 2)
+        self.assertEqual(profiler.report()[0]['requests'], 3)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def limiter(self, **kwargs):
+        limiter = AdaptiveLimiter(**kwargs)
+        self.clock = FakeClock()
+        limiter.clock = self.clock.time
+        return limiter
+
+    def round_trip(self, limiter, requests, latency, status=200,
+                   headers=None):
+        started = [limiter.acquire() for _ in range(requests)]
+        self.clock.now += latency
+        for t in started:
+            limiter.release(t, status, headers)
+
+    def test_increase(self):
+        limiter = self.limiter(initial=2, maximum=4)
+        for _ in range(6):
+            self.round_trip(limiter, limiter.limit, 0.1)
+        self.assertEqual(limiter.limit, 4)
+        # Only a limit which is reached grows
+        limiter._limit = 3
+        self.round_trip(limiter, 1, 0.1)
+        self.assertEqual(limiter.limit, 3)
+
+    def test_throttled(self):
+        limiter = self.limiter(initial=8)
+        self.round_trip(limiter, 1, 0.1)
+        # All the responses of a round trip count as one signal
+        self.round_trip(limiter, 4, 0.1, 403, [('Retry-After', '60')])
+        self.assertEqual(limiter.limit, 4)
+        self.clock.now += 1
+        self.round_trip(limiter, 1, 0.1, 429)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.metrics()['throttled'], 5)
+
+    def test_latency(self):
+        limiter = self.limiter(initial=8)
+        for _ in range(60):
+            self.round_trip(limiter, 1, 0.1)
+        self.assertEqual(limiter.limit, 8)
+        for _ in range(5):
+            self.round_trip(limiter, 1, 1.0)
+        self.assertLess(limiter.limit, 8)
+        self.assertEqual(limiter.metrics()['in_flight'], 0)
+
+    def test_latencyMix(self):
+        # Fast 304s among slow full pages do not make the latency look
+        # high
+        limiter = self.limiter(initial=8)
+        for n in range(100):
+            self.round_trip(limiter, 1, 0.25 if n % 2 else 0.03)
+        self.assertEqual(limiter.limit, 8)
+
+    def test_deadline(self):
+        limiter = self.limiter(initial=1)
+        limiter.acquire()
+        with self.assertRaises(DeadlineExceeded):
+            limiter.acquire(as_deadline(0.01))
+
+    def test_client(self):
+        limiter = AdaptiveLimiter(initial=1)
+        g = fakeGitHub([FakeResponse(body={}), FakeResponse(status=429)],
+                       limiter=limiter)
+        g.a.get()
+        g.b.get()
+        metrics = limiter.metrics()
+        self.assertEqual((metrics['requests'], metrics['throttled']), (2, 1))
+        self.assertEqual(metrics['in_flight'], 0)
+
+
 def test_github():
     g = GitHub()
     status, data = g.users.octocat.get()
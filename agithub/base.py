@@ -1,18 +1,24 @@
 # Copyright 2012-2016 Jonathan Paugh and contributors
 # See COPYING for license details
+import codecs
+import collections
+import copy
+import email.utils
 import json
+import logging
+import random
+import re
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial, update_wrapper
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from types import GeneratorType
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-import sys
-if sys.version_info[0:2] > (3, 0):
-    from http.client import HTTPConnection, HTTPSConnection
-    from urllib.parse import urlencode
-else:
-    from httplib import HTTPConnection, HTTPSConnection
-    from urllib import urlencode
-
-    class ConnectionError(OSError):
-        pass
+logger = logging.getLogger(__name__)
 
 VERSION = [2, 2, 2]
 STR_VERSION = 'v' + '.'.join(str(v) for v in VERSION)
@@ -101,6 +107,349 @@ class IncompleteRequest(object):
         return '%s: %s' % (self.__class__, self.url)
 
 
+class DNSCache(object):
+    """
+    Remembers the addresses host names resolved to for ttl seconds, so
+    that opening a connection does not cost a DNS lookup every time.
+
+    pin maps host names to the address (or list of addresses) to always
+    connect to, bypassing DNS altogether.
+    """
+    def __init__(self, ttl=60, pin=None):
+        self.ttl = ttl
+        self.pinned = {}
+        for host, addresses in (pin or {}).items():
+            self.pin(host, addresses)
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def pin(self, host, addresses):
+        if not isinstance(addresses, (list, tuple)):
+            addresses = [addresses]
+        self.pinned[host] = list(addresses)
+
+    def resolve(self, host, port):
+        """
+        Return the addresses to try, in order, to reach host on port
+        """
+        if host in self.pinned:
+            return self.pinned[host]
+        with self.lock:
+            entry = self.cache.get((host, port))
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+
+        addresses = []
+        for info in self.lookup(host, port):
+            address = info[4][0]
+            if address not in addresses:
+                addresses.append(address)
+        with self.lock:
+            self.cache[(host, port)] = (time.time() + self.ttl, addresses)
+        return addresses
+
+    def lookup(self, host, port):
+        return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+    def create_connection(self, address, timeout=None, source_address=None):
+        """
+        Like socket.create_connection, but resolving the host via the cache
+        """
+        host, port = address
+        error = None
+        for ip in self.resolve(host, port):
+            try:
+                return socket.create_connection(
+                    (ip, port), timeout, source_address)
+            except socket.error as e:
+                error = e
+        raise error or socket.error('Could not resolve ' + host)
+
+
+class DeadlineExceeded(Exception):
+    """
+    The deadline for an operation passed before it was complete. What was
+    done of it in time is in partial, if anything.
+    """
+    def __init__(self, message, partial=None):
+        super(DeadlineExceeded, self).__init__(message)
+        self.partial = partial
+
+
+class Deadline(object):
+    """
+    A point in time, seconds from now, by which an operation must be
+    complete. Pass one as deadline= to share it between several calls.
+    """
+    def __init__(self, seconds):
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        return self.expires - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, partial=None):
+        if self.expired():
+            raise DeadlineExceeded(
+                'The deadline passed before the operation was complete',
+                partial)
+
+    def cap(self, timeout):
+        """
+        Shorten timeout (in seconds, or None) so that it ends by the
+        deadline
+        """
+        self.check()
+        if timeout is None:
+            return self.remaining()
+        return min(timeout, self.remaining())
+
+
+class CachedDNSConnection(HTTPConnection):
+    """
+    An HTTPConnection which looks up its host in a DNSCache. If
+    read_timeout is given, it replaces the (connect) timeout once the
+    connection is made.
+    """
+    def __init__(self, host, dns_cache=None, read_timeout=None, **kwargs):
+        HTTPConnection.__init__(self, host, **kwargs)
+        if dns_cache is not None:
+            self._create_connection = dns_cache.create_connection
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        if self.read_timeout is not None:
+            self.sock.settimeout(self.read_timeout)
+
+
+class ResumingHTTPSConnection(HTTPSConnection):
+    """
+    An HTTPSConnection which looks up its host in a DNSCache, and resumes
+    the TLS session of an earlier connection to the same host, if there
+    was one, instead of going through a full handshake.
+
+    tls_sessions is the dict in which sessions are shared between
+    connections. They are only valid with the same SSLContext.
+
+    If read_timeout is given, it replaces the (connect) timeout once the
+    connection is made.
+    """
+    def __init__(self, host, dns_cache=None, tls_sessions=None,
+                 read_timeout=None, **kwargs):
+        HTTPSConnection.__init__(self, host, **kwargs)
+        if dns_cache is not None:
+            self._create_connection = dns_cache.create_connection
+        self.tls_sessions = tls_sessions if tls_sessions is not None else {}
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=server_hostname,
+            session=self.tls_sessions.get((server_hostname, self.port)))
+        if self.read_timeout is not None:
+            self.sock.settimeout(self.read_timeout)
+
+    def close(self):
+        # Remember the session on the way out; with TLS 1.3 the session
+        # ticket only arrives after the handshake
+        sock = self.sock
+        if sock is not None and getattr(sock, 'session', None) is not None:
+            server_hostname = self._tunnel_host or self.host
+            self.tls_sessions[(server_hostname, self.port)] = sock.session
+        HTTPSConnection.close(self)
+
+
+def as_deadline(deadline):
+    """
+    Turn a deadline= argument, in seconds or a Deadline, into a Deadline
+    """
+    if deadline is None or isinstance(deadline, Deadline):
+        return deadline
+    return Deadline(deadline)
+
+
+class deadline_on_timeout(object):
+    """
+    A context manager which turns a socket.timeout, raised because a
+    timeout was cut short by deadline, into DeadlineExceeded
+    """
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (exc_type is not None and issubclass(exc_type, socket.timeout)
+                and self.deadline is not None and self.deadline.expired()):
+            raise DeadlineExceeded(
+                'The deadline passed while waiting for a response')
+
+
+class RetryPolicy(object):
+    """
+    How to retry requests which fail transiently: with a 5xx status in
+    statuses, or with a reset connection, a timeout or another socket
+    error. Only idempotent methods are retried.
+
+    Each operation (a request, with all its pages) may retry up to retries
+    times in all. The n-th retry waits for a random time between 0 and
+    backoff * 2 ** n seconds (at most max_backoff), or as long as a
+    Retry-After header asks, but never past the operation's deadline.
+    """
+    methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+    statuses = (500, 502, 503, 504)
+    errors = (socket.error, HTTPException)
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = time.sleep
+
+    def budget(self):
+        return RetryBudget(self)
+
+
+class RetryBudget(object):
+    """
+    The retries left to one operation under a RetryPolicy. It may be
+    shared by the threads fetching the operation's pages.
+    """
+    def __init__(self, policy):
+        self.policy = policy
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def retry(self, method, reason, deadline=None, retry_after=None):
+        """
+        If a request which failed for reason may be retried, wait before
+        it is, and return True
+        """
+        if method.upper() not in self.policy.methods:
+            return False
+        with self.lock:
+            if self.used >= self.policy.retries:
+                return False
+            delay = random.uniform(0, min(
+                self.policy.backoff * 2 ** self.used,
+                self.policy.max_backoff))
+            retry_after = parse_retry_after(retry_after)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if deadline is not None and deadline.remaining() < delay:
+                return False
+            self.used += 1
+            attempt = self.used
+        logger.warning('Retrying {} (attempt {} of {}) in {:.1f} seconds, '
+                       'after {}'.format(method, attempt, self.policy.retries,
+                                         delay, reason))
+        self.policy.sleep(delay)
+        return True
+
+
+def parse_retry_after(value, now=None):
+    """
+    Return the number of seconds a Retry-After header value asks to wait,
+    whether it is given in seconds or as an HTTP-date; or None if it
+    cannot be parsed
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(email.utils.mktime_tz(date) - now, 0)
+
+
+def as_retry(retry):
+    """
+    Turn a retry= argument, a number of retries, a RetryPolicy or a
+    RetryBudget, into the RetryBudget for one operation
+    """
+    if retry is None or isinstance(retry, RetryBudget):
+        return retry
+    if not isinstance(retry, RetryPolicy):
+        retry = RetryPolicy(retries=retry)
+    return retry.budget()
+
+
+class PaginationError(TypeError):
+    """
+    A page of a paginated response failed, after any retries. partial
+    holds the items of the pages before it (unless they were streamed),
+    and continuation the means to pick the listing up again at the
+    failed page, rather than start over.
+    """
+    def __init__(self, message, status=None, data=None, partial=None,
+                 continuation=None):
+        super(PaginationError, self).__init__(message)
+        self.status = status
+        self.data = data
+        self.partial = partial
+        self.continuation = continuation
+
+
+class Continuation(object):
+    """
+    Where a paginated request stopped: resume() requests the rest of the
+    listing, from url on, with the given request options (paginate is
+    implied)
+    """
+    def __init__(self, client, method, url, bodyData=None, headers=None):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.bodyData = bodyData
+        self.headers = headers or {}
+
+    def resume(self, **options):
+        options.setdefault('paginate', True)
+        return self.client.request(
+            self.method, self.url, self.bodyData, dict(self.headers),
+            **options)
+
+    def __repr__(self):
+        return '<Continuation %s %s>' % (self.method, self.url)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_ssl_context():
+    """
+    The SSLContext shared by the Clients of this process which are not
+    given one of their own. Creating it loads the CA bundle, so it is
+    only done once.
+    """
+    with _shared_lock:
+        if 'ssl_context' not in _shared:
+            _shared['ssl_context'] = ssl.create_default_context()
+        return _shared['ssl_context']
+
+
+def shared_dns_cache():
+    """
+    The DNSCache shared by the Clients of this process which are not
+    given one of their own
+    """
+    with _shared_lock:
+        if 'dns_cache' not in _shared:
+            _shared['dns_cache'] = DNSCache()
+        return _shared['dns_cache']
+
+
 class Client(object):
     http_methods = (
         'head',
@@ -111,12 +460,60 @@ class Client(object):
         'patch',
     )
 
+    # Keyword arguments which the HTTP-method methods accept alongside
+    # headers= and body=. They configure the request itself, and are not
+    # sent as url parameters.
+    request_options = ('stream', 'paginate', 'timeout', 'deadline', 'retry')
+
     default_headers = {}
     headers = None
+    # How the API splits listings into pages (see Paginator)
+    paginator = None
+    timeout = None
+    limiter = None
+    retry = None
 
     def __init__(self, username=None, password=None, token=None,
-                 connection_properties=None):
+                 connection_properties=None, ssl_context=None,
+                 dns_cache=None, transport=None, paginator=None,
+                 timeout=None, limiter=None, retry=None):
+        """
+        ssl_context is the SSLContext for https connections; by default
+        one is shared by the whole process. dns_cache is the DNSCache to
+        resolve host names with; by default one is shared by the whole
+        process, and dns_cache=False disables caching.
+
+        transport, if given, provides the connections instead of the
+        network: its get_connection(client, timeouts) method is called
+        for each request (see agithub.replay).
+
+        paginator overrides the Paginator of the API.
+
+        timeout is the number of seconds to wait for the connection to be
+        made, and then for each read from it, before socket.timeout is
+        raised; or a (connect, read) tuple of them. By default, requests
+        wait forever. It can be overridden per request.
+
+        limiter, if given, limits the requests in flight at once, e.g. an
+        AdaptiveLimiter (see agithub.limiter) shared by the copies of the
+        client used from several threads.
+
+        retry is the RetryPolicy (or number of retries) for requests which
+        fail transiently. By default, they are not retried. It can be
+        overridden per request.
+        """
         self.prop = None
+        self.timeout = timeout
+        self.limiter = limiter
+        self.retry = retry
+        self.transport = transport
+        if paginator is not None:
+            self.paginator = paginator
+        self.ssl_context = ssl_context
+        if dns_cache is None:
+            dns_cache = shared_dns_cache()
+        self.dns_cache = dns_cache or None
+        self.tls_sessions = {}
 
         # Set up connection properties
         if connection_properties is not None:
@@ -148,32 +545,37 @@ class Client(object):
 
     def head(self, url, headers=None, **params):
         headers = headers or {}
+        options = self._pop_request_options(params)
         url += self.urlencode(params)
-        return self.request('HEAD', url, None, headers)
+        return self.request('HEAD', url, None, headers, **options)
 
     def get(self, url, headers=None, **params):
         headers = headers or {}
+        options = self._pop_request_options(params)
         url += self.urlencode(params)
-        return self.request('GET', url, None, headers)
+        return self.request('GET', url, None, headers, **options)
 
     def post(self, url, body=None, headers=None, **params):
         headers = headers or {}
+        options = self._pop_request_options(params)
         url += self.urlencode(params)
         if 'content-type' not in headers:
             headers['content-type'] = 'application/json'
-        return self.request('POST', url, body, headers)
+        return self.request('POST', url, body, headers, **options)
 
     def put(self, url, body=None, headers=None, **params):
         headers = headers or {}
+        options = self._pop_request_options(params)
         url += self.urlencode(params)
         if 'content-type' not in headers:
             headers['content-type'] = 'application/json'
-        return self.request('PUT', url, body, headers)
+        return self.request('PUT', url, body, headers, **options)
 
     def delete(self, url, headers=None, **params):
         headers = headers or {}
+        options = self._pop_request_options(params)
         url += self.urlencode(params)
-        return self.request('DELETE', url, None, headers)
+        return self.request('DELETE', url, None, headers, **options)
 
     def patch(self, url, body=None, headers=None, **params):
         """
@@ -182,15 +584,79 @@ class Client(object):
         Parameters is a dictionary that will will be urlencoded
         """
         headers = headers or {}
+        options = self._pop_request_options(params)
         url += self.urlencode(params)
         if 'content-type' not in headers:
             headers['content-type'] = 'application/json'
-        return self.request('PATCH', url, body, headers)
+        return self.request('PATCH', url, body, headers, **options)
 
-    def request(self, method, url, bodyData, headers):
+    def request(self, method, url, bodyData, headers, stream=None,
+                paginate=None, timeout=None, deadline=None, retry=None,
+                limit=None):
         """
         Low-level networking. All HTTP-method methods call this
+
+        If stream is given, a JSON response body is not read up front;
+        instead, an iterator over its array elements is returned (see
+        ResponseBody.iter_json). The connection stays open until that
+        iterator is exhausted or closed.
+
+        If paginate is given, the items of every page of the listing are
+        returned, as a list; or, if stream is also given, as an iterator
+        which fetches each page once it is reached (see iter_pages). If
+        the first page fails, or is not a listing, its status and body
+        are returned as they are. limit, a PageLimit, says which items to
+        keep and when to stop fetching pages.
+
+        timeout overrides the client's timeout. deadline is the number of
+        seconds (or a Deadline) by which the whole request, including all
+        its pages, must be complete; past it, DeadlineExceeded is raised,
+        holding the items fetched in time.
+
+        retry overrides the client's RetryPolicy, for the whole request.
+        If a page after the first fails for good, PaginationError is
+        raised, holding the items fetched so far and a Continuation.
+        """
+        deadline = as_deadline(deadline)
+        retry = as_retry(self.retry if retry is None else retry)
+        if not paginate:
+            return self.request_page(
+                method, url, bodyData, headers, stream, timeout, deadline,
+                retry)
+
+        pages = self.iter_pages(
+            method, url, bodyData, headers, timeout, deadline, retry, stream,
+            limit)
+        status, items = next(pages)
+        if not 200 <= status < 300 or not isinstance(
+                items, (list, GeneratorType)):
+            return status, items
+        if stream:
+            return status, self._chain_pages(items, pages)
+        items = list(items)
+        try:
+            for page_status, page_items in pages:
+                items.extend(page_items)
+        except (DeadlineExceeded, PaginationError) as e:
+            e.partial = items
+            raise
+        return status, items
+
+    def _chain_pages(self, items, pages):
+        for item in items:
+            yield item
+        for status, items in pages:
+            for item in items:
+                yield item
+
+    def request_page(self, method, url, bodyData, headers, stream=None,
+                     timeout=None, deadline=None, retry=None):
+        """
+        Request a single page, without following pagination. Without a
+        retry, the client's own retry policy applies.
         """
+        if retry is None:
+            retry = as_retry(self.retry)
 
         headers = self._fix_headers(headers)
         url = self.prop.constructUrl(url)
@@ -203,16 +669,250 @@ class Client(object):
 
         # TODO: Context manager
         requestBody = RequestBody(bodyData, headers)
-        conn = self.get_connection()
-        conn.request(method, url, requestBody.process(), headers)
-        response = conn.getresponse()
+        conn, response, content = self.send(
+            method, url, requestBody.process(), headers, stream, timeout,
+            deadline, retry)
         status = response.status
-        content = ResponseBody(response)
         self.headers = response.getheaders()
 
+        if content.stream:
+            return status, self._close_after(content.processBody(), conn)
         conn.close()
         return status, content.processBody()
 
+    def send(self, method, url, body, headers, stream=None, timeout=None,
+             deadline=None, retry=None):
+        """
+        Send a request on a new connection, retrying transient failures as
+        long as retry (a RetryBudget) allows. Return the connection, and
+        the response with its ResponseBody.
+        """
+        while True:
+            conn = self.get_connection(self.get_timeouts(timeout, deadline))
+            try:
+                response, content = self.exchange(
+                    conn, method, url, body, headers, stream, deadline)
+            except DeadlineExceeded:
+                raise
+            except RetryPolicy.errors as e:
+                conn.close()
+                if retry is None or not retry.retry(
+                        method, repr(e), deadline):
+                    raise
+                continue
+            if (retry is not None and
+                    response.status in retry.policy.statuses and
+                    retry.retry(method, 'status {}'.format(response.status),
+                                deadline, response.getheader('Retry-After'))):
+                conn.close()
+                continue
+            return conn, response, content
+
+    def exchange(self, conn, method, url, body, headers, stream=None,
+                 deadline=None):
+        """
+        Send a request on conn, and return the response with its
+        ResponseBody, waiting first for the limiter, if any, to let it go.
+        The limiter is released once the response headers are in, so the
+        latency it sees does not depend on the size of the body.
+        """
+        if self.limiter is not None:
+            started = self.limiter.acquire(deadline)
+        try:
+            with deadline_on_timeout(deadline):
+                conn.request(method, url, body, headers)
+                response = conn.getresponse()
+        except Exception:
+            if self.limiter is not None:
+                self.limiter.release(started)
+            raise
+        if self.limiter is not None:
+            self.limiter.release(
+                started, response.status, response.getheaders())
+        with deadline_on_timeout(deadline):
+            content = ResponseBody(response, stream)
+        return response, content
+
+    def _close_after(self, items, conn):
+        """
+        Pass items through, closing conn once they are exhausted (or the
+        iteration is abandoned)
+        """
+        try:
+            for item in items:
+                yield item
+        finally:
+            conn.close()
+
+    def iter_pages(self, method, url, bodyData=None, headers=None,
+                   timeout=None, deadline=None, retry=None, stream=None,
+                   limit=None):
+        """
+        Yield the status and items of each page of the listing at url, as
+        split up by the client's paginator, fetching each page once the
+        previous one has been consumed.
+
+        Where the paginator can tell the urls of all the pages from the
+        first one, up to paginator.prefetch of them are fetched
+        concurrently, ahead of the consumer. If stream is given and the
+        paginator streams, the items of each page are an iterator over
+        its streamed body (see ResponseBody.iter_json).
+
+        limit, a PageLimit, filters the items of each page, and is asked
+        whether to go on before each page after the first is fetched.
+
+        If the first page fails, or is not a listing, its status and body
+        are yielded as they are, and nothing more. If a later page fails
+        (after any retries), PaginationError is raised, with a
+        Continuation from that page. If the deadline passes,
+        DeadlineExceeded is raised.
+        """
+        headers = headers or {}
+        paginator = self.paginator or Paginator()
+        status, data = self.request_page(
+            method, url, bodyData, dict(headers),
+            stream if paginator.streams else None, timeout, deadline, retry)
+        if not 200 <= status < 300:
+            yield status, data
+            return
+        items = paginator.items(data)
+        if not isinstance(items, (list, GeneratorType)):
+            yield status, items
+            return
+        yield status, self._limit_items(items, limit)
+        for page in self.iter_next_pages(
+                method, url, data, bodyData, headers, timeout, deadline,
+                retry, stream, limit):
+            yield page
+
+    def iter_next_pages(self, method, url, data, bodyData=None, headers=None,
+                        timeout=None, deadline=None, retry=None, stream=None,
+                        limit=None):
+        """
+        Yield the status and items of each page of the listing at url
+        after the first, whose body was data, as iter_pages does. The last
+        response of the client must be that of the first page.
+        """
+        headers = headers or {}
+        paginator = self.paginator or Paginator()
+        fetch = partial(self._fetch_page, method, bodyData=bodyData,
+                        timeout=timeout, deadline=deadline, retry=retry,
+                        stream=stream if paginator.streams else None)
+        urls = paginator.page_urls(self, url, data)
+        if urls is not None and paginator.prefetch > 1:
+            pages = self._prefetch_pages(
+                fetch, urls, headers, paginator.prefetch, deadline)
+        else:
+            pages = self._follow_pages(
+                fetch, url, headers, paginator, data, urls, deadline)
+
+        try:
+            while limit is None or limit.more_pages():
+                page = next(pages, None)
+                if page is None:
+                    return
+                url, status, data = page
+                items = None
+                if status is not None and 200 <= status < 300:
+                    items = paginator.items(data)
+                if not isinstance(items, (list, GeneratorType)):
+                    if isinstance(data, GeneratorType):
+                        data.close()
+                        data = None
+                    raise PaginationError(
+                        self._page_error(status, data), status, data,
+                        continuation=Continuation(
+                            self, method, url, bodyData, headers))
+                yield status, self._limit_items(items, limit)
+        finally:
+            pages.close()
+
+    def _page_error(self, status, data):
+        """
+        The message of the PaginationError raised when a page after the
+        first comes back with status (None if the request failed for
+        good) and data rather than with a listing
+        """
+        return (
+            'While fetching a page of a paginated response, {} was '
+            'returned: {}'.format(
+                'status {}'.format(status) if status else 'no status',
+                data))
+
+    def _limit_items(self, items, limit):
+        if limit is None:
+            return items
+        if isinstance(items, list):
+            return [item for item in items if limit.keep(item)]
+        return self._stream_limited(items, limit)
+
+    def _stream_limited(self, items, limit):
+        for item in items:
+            if not limit.keep(item):
+                items.close()
+                return
+            yield item
+
+    def _fetch_page(self, method, url, bodyData, headers, timeout, deadline,
+                    retry, stream=None, client=None):
+        """
+        Fetch a page after the first one of a listing; the url, status and
+        data are returned. A request which fails for good, with an
+        exception RetryPolicy.errors names, comes back without a status.
+        """
+        client = client or self
+        logger.debug(
+            'Fetching an additional page of a paginated response at '
+            '{}'.format(url))
+        try:
+            status, data = client.request_page(
+                method, url, bodyData, headers, stream, timeout, deadline,
+                retry)
+        except RetryPolicy.errors as e:
+            return url, None, repr(e)
+        return url, status, data
+
+    def _follow_pages(self, fetch, url, headers, paginator, data, urls,
+                      deadline):
+        if urls is not None:
+            for url in urls:
+                if deadline is not None:
+                    deadline.check()
+                yield fetch(url=url, headers=dict(headers))
+            return
+        while True:
+            url = paginator.next_url(self, url, data)
+            if not url:
+                return
+            if deadline is not None:
+                deadline.check()
+            url, status, data = fetch(url=url, headers=dict(headers))
+            yield url, status, data
+
+    def _prefetch_pages(self, fetch, urls, headers, prefetch, deadline):
+        with ThreadPoolExecutor(prefetch) as pool:
+            pending = collections.deque()
+            for url in urls:
+                if deadline is not None and deadline.expired():
+                    # Hand out what was fetched in time, then give up
+                    while pending:
+                        yield pending.popleft().result()
+                    deadline.check()
+                pending.append(pool.submit(
+                    fetch, url=url, headers=dict(headers),
+                    client=self.for_thread()))
+                if len(pending) >= prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _pop_request_options(self, params):
+        options = {}
+        for key in self.request_options:
+            if key in params:
+                options[key] = params.pop(key)
+        return options
+
     def _fix_headers(self, headers):
         # Convert header names to a uniform case
         tmp_dict = {}
@@ -226,17 +926,95 @@ class Client(object):
                 headers[k] = v
         return headers
 
+    def for_thread(self):
+        """
+        Return a copy of the client for another thread to make requests
+        with. The copy shares the client's settings, and its limiter,
+        caches and profiler, but, as the client keeps the headers of the
+        last response (see getheader), each thread needs one of its own.
+        """
+        return copy.copy(self)
+
+    def getheader(self, name, default=None):
+        """
+        Return the value of the named header in the last response. The
+        name is case-insensitive.
+        """
+        name = name.lower()
+        for key, value in self.headers or []:
+            if key.lower() == name:
+                return value
+        return default
+
+    def get_next_link_url(self):
+        """Given a set of HTTP headers find the RFC 5988 Link header field,
+        determine if it contains a relation type indicating a next resource and
+        if so return the URL of the next resource, otherwise return an empty
+        string.
+
+        From https://github.com/requests/requests/blob/master/requests/utils.py
+        """
+        for value in [x[1] for x in self.headers if x[0].lower() == 'link']:
+            replace_chars = ' \'"'
+            value = value.strip(replace_chars)
+            if not value:
+                return ''
+            for val in re.split(', *<', value):
+                try:
+                    url, params = val.split(';', 1)
+                except ValueError:
+                    url, params = val, ''
+                link = {'url': url.strip('<> \'"')}
+                for param in params.split(';'):
+                    try:
+                        key, value = param.split('=')
+                    except ValueError:
+                        break
+                    link[key.strip(replace_chars)] = value.strip(replace_chars)
+                if link.get('rel') == 'next':
+                    return link['url']
+        return ''
+
     def urlencode(self, params):
         if not params:
             return ''
         return '?%s' % urlencode(params)
 
-    def get_connection(self):
+    def get_timeouts(self, timeout=None, deadline=None):
+        """
+        Return the (connect, read) timeouts for a request, given its own
+        timeout and deadline, if any
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not isinstance(timeout, (tuple, list)):
+            timeout = (timeout, timeout)
+        if deadline is not None:
+            timeout = tuple(deadline.cap(t) for t in timeout)
+        return tuple(timeout)
+
+    def get_connection(self, timeouts=(None, None)):
+        if self.transport is not None:
+            return self.transport.get_connection(self, timeouts)
+        return self.open_connection(timeouts)
+
+    def open_connection(self, timeouts=(None, None)):
+        """
+        Open a connection to the API over the network, with the given
+        (connect, read) timeouts
+        """
+        connect_timeout, read_timeout = timeouts
+        kwargs = {'dns_cache': self.dns_cache, 'read_timeout': read_timeout}
+        if connect_timeout is not None:
+            kwargs['timeout'] = connect_timeout
         if self.prop.secure_http:
-            conn = HTTPSConnection(self.prop.api_url)
+            conn = ResumingHTTPSConnection(
+                self.prop.api_url,
+                context=self.ssl_context or shared_ssl_context(),
+                tls_sessions=self.tls_sessions, **kwargs)
         elif self.prop.extra_headers is None \
                 or 'authorization' not in self.prop.extra_headers:
-            conn = HTTPConnection(self.prop.api_url)
+            conn = CachedDNSConnection(self.prop.api_url, **kwargs)
         else:
             raise ConnectionError(
                 'Refusing to send the authorization header over an '
@@ -246,6 +1024,253 @@ class Client(object):
         return conn
 
 
+class BatchedRequest(object):
+    """
+    A request collected by a Batch. Once the batch has been sent, status
+    and data hold its response.
+    """
+    def __init__(self, method, url, body, headers):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.status = None
+        self.data = None
+
+    def __repr__(self):
+        return '<BatchedRequest %s %s: %s>' % (
+            self.method, self.url, self.status)
+
+
+class _BatchRecorder(Client):
+    """
+    A Client which, instead of sending requests, adds them to a Batch
+    """
+    def __init__(self, batch):
+        self.batch = batch
+
+    def request(self, method, url, bodyData, headers, **options):
+        request = BatchedRequest(method, url, bodyData, headers)
+        self.batch.requests.append(request)
+        return request
+
+
+class Batch(object):
+    """
+    Collects requests, to send them together, in as few of the API's
+    native batch requests as it allows. Requests are built as usual, but
+    calling the HTTP method returns a BatchedRequest:
+
+    >>> with api.batch() as batch:
+    ...     a = batch.path.to.resource.get()
+    ...     b = batch.path.to.other.post(body={'name': 'value'})
+    >>> a.status, a.data
+
+    The requests are sent when the with block exits (unless it raises),
+    or by calling send(). Subclasses implement send_batch for a specific
+    API, which is given up to limit requests at a time.
+
+    If deadline (in seconds, or a Deadline) passes while sending, the
+    batches not yet sent are dropped, and DeadlineExceeded is raised,
+    holding all the requests; those which were sent have a status.
+
+    headers and params are sent with each native batch request, e.g. the
+    credentials the API expects on it.
+    """
+    limit = 1
+
+    def __init__(self, client, deadline=None, headers=None, **params):
+        self.client = client
+        self.deadline = as_deadline(deadline)
+        self.headers = headers or {}
+        self.params = params
+        self.recorder = _BatchRecorder(self)
+        self.requests = []
+
+    def __getattr__(self, key):
+        return IncompleteRequest(self.recorder).__getattr__(key)
+    __getitem__ = __getattr__
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def send(self):
+        """
+        Send the collected requests, and return them
+        """
+        requests, self.requests = self.requests, []
+        try:
+            for start in range(0, len(requests), self.limit):
+                if self.deadline is not None:
+                    self.deadline.check()
+                self.send_batch(requests[start:start + self.limit])
+        except DeadlineExceeded as e:
+            e.partial = requests
+            raise
+        return requests
+
+    def post(self, url, body):
+        """
+        Send a native batch request
+        """
+        return self.client.post(url, body=body, headers=dict(self.headers),
+                                deadline=self.deadline, **self.params)
+
+    def send_batch(self, requests):
+        raise NotImplementedError
+
+    def fail(self, requests, status, data):
+        """
+        Give all of requests the response of the batch request which
+        failed to carry them
+        """
+        for request in requests:
+            request.status = status
+            request.data = data
+
+    def parse(self, body):
+        """
+        Parse a JSON body embedded as a string in a batch response
+        """
+        try:
+            return json.loads(body)
+        except (TypeError, ValueError):
+            return body
+
+
+class Paginator(object):
+    """
+    Describes how an API splits a listing into pages. This one treats
+    every response as a single page; subclass it for APIs that paginate.
+
+    items(data) returns the items of a page, given its response body; or
+    the body itself, if it is not a listing (e.g. a single object), which
+    the client then returns as it is.
+
+    To follow the pages one at a time, next_url(client, url, data)
+    returns the url of the page after the one at url (whose body was
+    data), or None on the last page.
+
+    If the urls of all the pages can be told from the first one, as with
+    offset-based pagination, page_urls(client, url, data) returns the urls
+    of all the following pages instead. Up to prefetch of them are then
+    fetched at once.
+
+    The urls returned are passed to the client as they are, so they are
+    relative to the API's url_prefix, unless absolute.
+
+    If streams is set, items() also accepts the iterator a streamed
+    response body is read as, so the pages of a streamed request are
+    streamed too.
+    """
+    prefetch = 1
+    streams = False
+
+    def items(self, data):
+        return data
+
+    def next_url(self, client, url, data):
+        return None
+
+    def page_urls(self, client, url, data):
+        return None
+
+
+class LinkPaginator(Paginator):
+    """
+    A Paginator for APIs which give the url of the next page in the Link
+    header of each response (see Client.get_next_link_url), with the
+    items of the page as the body.
+    """
+    streams = True
+
+    def next_url(self, client, url, data):
+        return client.get_next_link_url()
+
+
+class PageLimit(object):
+    """When to stop following pagination links.
+
+    stop_when is a function of an item; the first item for which it
+    returns True ends the listing, and is not included. This suits
+    listings returned in a known order, e.g. to only keep the GitHub
+    issues created after a certain time:
+
+    >>> g.repos.octocat.hello.issues.get(
+    ...     sort='created', stop_when=lambda i: i['created_at'] < since)
+
+    max_items caps the number of items returned, and max_pages the number
+    of pages fetched."""
+    def __init__(self, stop_when=None, max_items=None, max_pages=None):
+        self.stop_when = stop_when
+        self.max_items = max_items
+        self.max_pages = max_pages
+        self.items = 0
+        self.pages = 0
+        self.done = False
+
+    def limited(self):
+        return (self.stop_when is not None or self.max_items is not None
+                or self.max_pages is not None)
+
+    def keep(self, item):
+        """Whether to include item in the listing"""
+        if self.done:
+            return False
+        if ((self.max_items is not None and self.items >= self.max_items)
+                or (self.stop_when is not None and self.stop_when(item))):
+            self.done = True
+            return False
+        self.items += 1
+        return True
+
+    def more_pages(self):
+        """Called once a page is done with; whether to fetch the next"""
+        self.pages += 1
+        if ((self.max_pages is not None and self.pages >= self.max_pages)
+                or (self.max_items is not None
+                    and self.items >= self.max_items)):
+            self.done = True
+        return not self.done
+
+
+class OffsetPaginator(Paginator):
+    """
+    A Paginator for APIs which page through listings with offset and
+    limit url parameters, and tell the total number of items up front.
+    Subclasses provide items() and total().
+    """
+    offset = 'offset'
+    limit = 'limit'
+    default_limit = 10
+
+    def __init__(self, prefetch=4):
+        self.prefetch = prefetch
+
+    def total(self, data):
+        raise NotImplementedError
+
+    def page_urls(self, client, url, data):
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        params = [(k, v) for k, v in parse_qsl(query, True)
+                  if k != self.offset]
+        query_dict = dict(parse_qsl(query, True))
+        start = int(query_dict.get(self.offset, 0))
+        limit = int(query_dict.get(self.limit, self.default_limit))
+        if limit <= 0:
+            return []
+        return [
+            urlunsplit((scheme, netloc, path,
+                        urlencode(params + [(self.offset, offset)]),
+                        fragment))
+            for offset in range(start + limit, self.total(data), limit)
+        ]
+
+
 class Body(object):
     """
     Superclass for ResponseBody and RequestBody
@@ -299,12 +1324,27 @@ class Body(object):
 class ResponseBody(Body):
     """
     Decode a response from the server, respecting the Content-Type field
+
+    If stream is given and the media-type can be decoded incrementally,
+    the body of a successful response is left unread, and processBody
+    returns an iterator instead (see iter_json). Other responses, such as
+    errors and 304s, are read and decoded as usual.
     """
-    def __init__(self, response):
+    # Media-type handlers which support stream
+    streamable_mtypes = ('application_json', 'text_javascript')
+
+    def __init__(self, response, stream=None):
         self.response = response
-        self.body = response.read()
         self.parseContentType(self.response.getheader('Content-Type'))
         self.encoding = self.ctypeParameters['charset']
+        if (stream and self.mangled_mtype() in self.streamable_mtypes
+                and 200 <= response.status < 300 and response.status != 204
+                and response.getheader('Content-Length') != '0'):
+            self.stream = stream
+            self.body = None
+        else:
+            self.stream = None
+            self.body = response.read()
 
     def decode_body(self):
         """
@@ -335,6 +1375,9 @@ class ResponseBody(Body):
         """
         Handler for application/json media-type
         """
+        if self.stream:
+            return self.iter_json(self.stream)
+
         self.decode_body()
 
         try:
@@ -344,12 +1387,147 @@ class ResponseBody(Body):
 
         return pybody
 
+    def iter_json(self, path=True):
+        """
+        Decode the response body as it arrives, yielding the elements of
+        a JSON array one at a time.
+
+        With path=True, the array is the whole document. Otherwise, path
+        names the key (or a dotted path of keys, or a tuple of them)
+        holding the array inside the document's objects, e.g. 'tree' for
+        git trees or 'items' for search results. Sibling keys are read
+        and discarded.
+
+        If the document does not have the expected shape (e.g. an error
+        message was returned instead), the offending value is yielded
+        whole, so it is not silently lost.
+        """
+        if path is True:
+            path = ()
+        elif not isinstance(path, (tuple, list)):
+            path = path.split('.')
+        return _IncrementalJSON(self.response, self.encoding).items(path)
+
     text_javascript = application_json
     # XXX: This isn't technically correct, but we'll hope for the best.
     # Patches welcome!
     # Insert new media-type handlers here
 
 
+class _IncrementalJSON(object):
+    """
+    Pull complete JSON values out of a file-like object as its bytes
+    arrive. Only the value being decoded is kept in memory.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, fp, encoding):
+        self.fp = fp
+        self.read = getattr(fp, 'read1', fp.read)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size):
+        data = self.read(size)
+        self.buf = self.buf[self.pos:] + self.decoder.decode(data, not data)
+        self.pos = 0
+        self.eof = not data
+
+    def peek(self):
+        """
+        Skip whitespace, then return the next character without consuming
+        it, or '' at the end of the document
+        """
+        while True:
+            while (self.pos < len(self.buf)
+                   and self.buf[self.pos] in ' \t\r\n'):
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ''
+            self.fill(self.chunk_size)
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                'Expected one of %r in JSON document, got %r' % (chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next complete value, reading more of the body as needed
+        """
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+            else:
+                # A number may be cut short where the body was split
+                # (e.g. '1' of '1.5' or '2' of '2e3'): it is only complete
+                # once followed by a character which cannot continue it
+                number = isinstance(value, (int, float)) \
+                    and not isinstance(value, bool)
+                if (self.eof or not number or end < len(self.buf)
+                        and self.buf[end] in ' \t\r\n,]}'):
+                    self.pos = end
+                    return value
+            self.fill(size)
+            size *= 2
+
+    def enter(self, key):
+        """
+        Advance to the value of key in the object at the current position.
+        Returns the other members read along the way, and whether key was
+        found.
+        """
+        skipped = {}
+        self.expect('{')
+        if self.peek() == '}':
+            return skipped, False
+        while True:
+            name = self.value()
+            self.expect(':')
+            if name == key:
+                return skipped, True
+            skipped[name] = self.value()
+            if self.expect(',}') == '}':
+                return skipped, False
+
+    def items(self, path):
+        if not self.peek():
+            # An empty body holds no items
+            return
+        for key in path:
+            if self.peek() != '{':
+                yield self.value()
+                return
+            skipped, found = self.enter(key)
+            if not found:
+                yield skipped
+                return
+
+        if self.peek() != '[':
+            yield self.value()
+            return
+        self.pos += 1
+        if self.peek() == ']':
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
 class RequestBody(Body):
     """
     Encode a request body from the client, respecting the Content-Type
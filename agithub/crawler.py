@@ -0,0 +1,201 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Declarative crawls of trees of GitHub listings, e.g. an organization's
+repositories, their issues and pull requests, and the comments on those.
+
+Each Level names a url template, which is filled in from the items of the
+parent level, and the levels below it. The requests of all the levels run
+concurrently on one pool of workers: the children of an item are queued
+as soon as the page holding it arrives, and deeper levels are served
+first, so that the crawl streams its results out rather than going level
+by level.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.crawler import Crawler, Level
+>>> g = GitHub(token='...')
+>>> comments = Level('comment', '{comments_url}',
+...                  when=lambda issue: issue['comments'] > 0)
+>>> repos = Level('repo', '/orgs/{org}/repos', children=[
+...     Level('issue', '/repos/{full_name}/issues', children=[comments],
+...           params={'state': 'all'}),
+...     Level('contributor', '/repos/{full_name}/contributors'),
+... ])
+>>> for result in Crawler(g, repos, workers=8).run(org='mozilla'):
+...     save(result.level, result.item)
+"""
+import collections
+import itertools
+import logging
+import queue
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The item, the name of its level, and the Result of the item it was
+# fetched for (None at the top level)
+Result = collections.namedtuple('Result', 'level item parent')
+
+
+class Level(object):
+    """
+    A level of a crawl. url is a template, which str.format fills in with
+    the fields of the parent item (or, at the top level, the arguments of
+    Crawler.run), e.g. '/repos/{full_name}/pulls' or
+    '/repos/{owner[login]}/{name}/branches'. Hypermedia urls given by
+    GitHub, such as '{issues_url}', may be used as they are: their own
+    templates ('{/number}') are dropped.
+
+    params are added to the url as parameters. when, given a parent item,
+    says whether to fetch this level for it at all.
+    """
+    def __init__(self, name, url, children=(), params=None, when=None):
+        self.name = name
+        self.url = url
+        self.children = list(children)
+        self.params = params or {}
+        self.when = when
+
+    def url_for(self, client, fields):
+        url = self.url.format(**fields)
+        url = re.sub(r'\{[/?&+#][^}]*\}', '', url)
+        if self.params:
+            url += ('&' if '?' in url else '?') + \
+                client.urlencode(self.params)[1:]
+        return url
+
+
+class Crawler(object):
+    """
+    Crawl a tree of Levels with a pool of workers.
+
+    At most buffer results wait to be consumed: once there are that many,
+    the workers stop fetching until the consumer catches up. per_second,
+    if given, caps the rate of requests of all the workers together; the
+    GitHub ratelimit is honored by the client itself.
+
+    Responses other than 200 (e.g. a 404 for a repository whose issues
+    are disabled) do not stop the crawl. They are logged, and kept in
+    failures as (url, status, data).
+    """
+    def __init__(self, github, level, workers=8, buffer=1000,
+                 per_second=None):
+        self.github = github
+        self.level = level
+        self.workers = workers
+        self.buffer = buffer
+        self.per_second = per_second
+        self.failures = []
+
+    def run(self, **fields):
+        """
+        Yield a Result for each item of the crawl, as they arrive. The
+        arguments fill in the top level's url. Stopping early stops the
+        crawl.
+        """
+        self.failures = []
+        self.tasks = queue.PriorityQueue()
+        self.results = queue.Queue(self.buffer)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.sequence = itertools.count()
+        self.next_send = 0
+        self.stopped = threading.Event()
+        self.finished = threading.Event()
+        self.errors = []
+
+        self.submit(self.level, fields, None, 0)
+        threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            while True:
+                try:
+                    yield self.results.get(timeout=0.1)
+                except queue.Empty:
+                    if self.finished.is_set() and self.results.empty():
+                        break
+        finally:
+            self.stopped.set()
+            for _ in threads:
+                self.tasks.put((float('inf'), next(self.sequence), None))
+            for thread in threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def submit(self, level, fields, parent, depth):
+        if level.when is not None and not level.when(fields):
+            return
+        with self.lock:
+            self.pending += 1
+        # Deeper levels first, to keep the number of queued requests down
+        self.tasks.put(
+            (-depth, next(self.sequence), (level, fields, parent, depth)))
+
+    def work(self):
+        client = self.github.client.for_thread()
+        while True:
+            task = self.tasks.get()[2]
+            if task is None:
+                return
+            try:
+                if not self.stopped.is_set():
+                    self.fetch(client, *task)
+            except Exception as e:
+                self.errors.append(e)
+                self.stopped.set()
+                self.finished.set()
+            with self.lock:
+                self.pending -= 1
+                if self.pending == 0:
+                    self.finished.set()
+
+    def fetch(self, client, level, fields, parent, depth):
+        url = level.url_for(client, fields)
+        while url and not self.stopped.is_set():
+            self.pace()
+            logger.debug('Crawling {} at {}'.format(level.name, url))
+            status, data = client.request_page('GET', url, None, {})
+            if status == 204:
+                return
+            if status != 200:
+                logger.warning('Crawling {} at {} returned status {}'
+                               .format(level.name, url, status))
+                self.failures.append((url, status, data))
+                return
+            url = client.get_next_link_url()
+            for item in data if isinstance(data, list) else [data]:
+                result = Result(level.name, item, parent)
+                for child in level.children:
+                    self.submit(child, item, result, depth + 1)
+                if not self.put(result):
+                    return
+
+    def put(self, result):
+        """
+        Hand a result to the consumer, waiting while the buffer is full.
+        Returns False if the crawl was stopped meanwhile.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.results.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pace(self):
+        if not self.per_second:
+            return
+        with self.lock:
+            now = time.time()
+            wait = self.next_send - now
+            self.next_send = max(now, self.next_send) + 1.0 / self.per_second
+        if wait > 0:
+            time.sleep(wait)
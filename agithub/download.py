@@ -0,0 +1,318 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Parallel, resumable downloads of large files, such as release assets and
+archives.
+
+The file's size and support for byte ranges are probed first. If the
+server supports ranges, the file is fetched in chunks by a pool of
+workers, each chunk written at its offset in a preallocated file. The
+chunks already on disk are recorded next to it, so a download that fails
+resumes where it stopped. Once complete, the size and (if given) digest
+of the file are checked before it is moved into place.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.download import Download
+>>> g = GitHub(token='...')
+>>> asset = g.repos.octocat.hello.releases.assets[1234]
+>>> Download(asset, 'hello.tar.gz', workers=8, digest='sha256:9f86d0...',
+...          headers={'accept': 'application/octet-stream'}).run()
+'hello.tar.gz'
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+
+from agithub.base import (
+    CachedDNSConnection, ResumingHTTPSConnection, shared_ssl_context,
+    urlsplit, urlunsplit)
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """
+    A download failed, or the file did not match its expected size or
+    digest. The chunks already fetched are kept, for the next attempt to
+    resume from.
+    """
+    pass
+
+
+class Download(object):
+    """
+    Download the resource at request (an IncompleteRequest) to path.
+
+    The file is fetched in chunks of chunk_size bytes by workers threads;
+    each chunk is tried up to retries times. Redirects are followed, and
+    the client's authorization header is only sent to the API's own host.
+    The url redirected to is reused for the following chunks until it
+    answers with a 4xx, as presigned urls do once they expire; then it is
+    resolved again from the request's url. Each run starts from the
+    request's url too.
+    digest is the expected hex digest of the file, optionally prefixed
+    with its algorithm ('sha256:...', the default algorithm); GitHub
+    gives it as the digest of release assets.
+
+    While in progress, the file is written to path + '.partial', and the
+    chunks fetched are recorded in path + '.partial.json'.
+    """
+    def __init__(self, request, path, headers=None, chunk_size=8 << 20,
+                 workers=4, digest=None, retries=3, timeout=None,
+                 max_redirects=5):
+        self.client = request.client
+        self.url = self.client.prop.constructUrl(request.url)
+        self.path = path
+        self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.algorithm, self.digest = 'sha256', digest
+        if digest and ':' in digest:
+            self.algorithm, self.digest = digest.split(':', 1)
+        self.retries = retries
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.partial = path + '.partial'
+        self.state_path = self.partial + '.json'
+
+    def run(self):
+        """Download the file, and return its path"""
+        url, size, validator = self.probe()
+        if size is None:
+            logger.debug('{} does not support ranges; downloading it in '
+                         'one piece'.format(url))
+            self.fetch_whole(url)
+        else:
+            self.fetch_ranges(url, size, validator)
+        self.verify(size)
+        os.replace(self.partial, self.path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return self.path
+
+    def probe(self):
+        """
+        Find the file's final url, after redirects; its size, if it can
+        be fetched in ranges (None otherwise); and its ETag or
+        Last-Modified date. HEAD is tried first; where it is not allowed
+        (e.g. on presigned urls, which are only valid for GET), the first
+        byte is asked for instead.
+        """
+        url, conn, response = self.open('HEAD', self.url)
+        response.read()
+        conn.close()
+        if (response.status == 200 and
+                response.getheader('Accept-Ranges', '').lower() == 'bytes' and
+                response.getheader('Content-Length') is not None):
+            size = int(response.getheader('Content-Length'))
+        else:
+            url, conn, response = self.open(
+                'GET', url, {'range': 'bytes=0-0'})
+            response.read()
+            conn.close()
+            content_range = response.getheader('Content-Range', '')
+            if response.status == 206 and '/' in content_range:
+                size = int(content_range.rsplit('/', 1)[1])
+            elif response.status == 200:
+                size = None
+            else:
+                raise DownloadError(
+                    'Probing {} returned status {}'
+                    .format(url, response.status))
+        validator = (response.getheader('ETag') or
+                     response.getheader('Last-Modified'))
+        return url, size, validator
+
+    def fetch_whole(self, url):
+        url, conn, response = self.open('GET', url)
+        try:
+            if response.status != 200:
+                raise DownloadError('Downloading {} returned status {}'
+                                    .format(url, response.status))
+            with open(self.partial, 'wb') as f:
+                self.copy(response, f, None)
+        finally:
+            conn.close()
+
+    def fetch_ranges(self, url, size, validator):
+        state = self.load_state(size, validator)
+        if state['done'] and os.path.exists(self.partial):
+            logger.debug('Resuming the download of {} with {} chunks done'
+                         .format(url, len(state['done'])))
+        else:
+            state['done'] = []
+            with open(self.partial, 'wb') as f:
+                f.truncate(size)
+
+        # The url the chunks are fetched from, shared by the workers so that
+        # once one of them resolves it again, the others use the new one
+        current = [url]
+        chunks = queue.Queue()
+        done = set(state['done'])
+        for start in range(0, size, self.chunk_size):
+            if start not in done:
+                chunks.put(start)
+        lock = threading.Lock()
+        errors = []
+
+        def work():
+            while not errors:
+                try:
+                    start = chunks.get_nowait()
+                except queue.Empty:
+                    return
+                end = min(start + self.chunk_size, size) - 1
+                try:
+                    url = self.fetch_range(current[0], start, end)
+                except Exception as e:
+                    errors.append(e)
+                    return
+                with lock:
+                    current[0] = url
+                    state['done'].append(start)
+                    self.save_state(state)
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(min(self.workers, chunks.qsize()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def fetch_range(self, url, start, end):
+        """
+        Fetch bytes start to end (inclusive) from url into the partial
+        file, and return the url they came from. After a 4xx, the next
+        attempt resolves the url again from the request's url.
+        """
+        for attempt in range(self.retries):
+            expired = False
+            try:
+                url, conn, response = self.open(
+                    'GET', url, {'range': 'bytes={}-{}'.format(start, end)})
+                try:
+                    if response.status != 206:
+                        expired = 400 <= response.status < 500
+                        raise DownloadError(
+                            'Fetching bytes {}-{} of {} returned status {}'
+                            .format(start, end, url, response.status))
+                    with open(self.partial, 'r+b') as f:
+                        f.seek(start)
+                        self.copy(response, f, end - start + 1)
+                finally:
+                    conn.close()
+                return url
+            except (DownloadError, EnvironmentError) as e:
+                logger.warning('Fetching bytes {}-{} of {} failed (attempt '
+                               '{}): {}'.format(start, end, url,
+                                                attempt + 1, e))
+                error = e
+            if expired:
+                url = self.url
+        raise error
+
+    def copy(self, response, f, length):
+        written = 0
+        while True:
+            data = response.read(64 << 10)
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+        if length is not None and written != length:
+            raise DownloadError('Expected {} bytes, got {}'
+                                .format(length, written))
+
+    def open(self, method, url, headers=None):
+        """
+        Send a request, following redirects. Return the final url, the
+        connection, and the response.
+        """
+        for _ in range(self.max_redirects + 1):
+            conn, target, request_headers = self.connect(url)
+            request_headers.update(headers or {})
+            conn.request(method, target, None, request_headers)
+            response = conn.getresponse()
+            location = response.getheader('Location')
+            if response.status not in (301, 302, 303, 307, 308) \
+                    or not location:
+                return url, conn, response
+            response.read()
+            conn.close()
+            logger.debug('{} redirects to {}'.format(url, location))
+            url = location
+        raise DownloadError('Too many redirects from {}'.format(self.url))
+
+    def connect(self, url):
+        """
+        Return a connection for url, the url to request on it, and the
+        headers to send
+        """
+        headers = self.client._fix_headers(self.headers)
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if not netloc or netloc == self.client.prop.api_url:
+            timeouts = self.client.get_timeouts(self.timeout)
+            return (self.client.get_connection(timeouts),
+                    urlunsplit(('', '', path, query, '')), headers)
+
+        # Another host, e.g. a storage service a release asset redirects
+        # to: the API's credentials are not for its eyes
+        headers.pop('authorization', None)
+        connect_timeout, read_timeout = self.client.get_timeouts(self.timeout)
+        kwargs = {'dns_cache': self.client.dns_cache,
+                  'read_timeout': read_timeout}
+        if connect_timeout is not None:
+            kwargs['timeout'] = connect_timeout
+        if scheme == 'https':
+            context = self.client.ssl_context or shared_ssl_context()
+            conn = ResumingHTTPSConnection(
+                netloc, context=context,
+                tls_sessions=self.client.tls_sessions, **kwargs)
+        else:
+            conn = CachedDNSConnection(netloc, **kwargs)
+        return conn, urlunsplit(('', '', path, query, '')), headers
+
+    def verify(self, size):
+        actual = os.path.getsize(self.partial)
+        if size is not None and actual != size:
+            raise DownloadError('Downloaded {} bytes of {}, expected {}'
+                                .format(actual, self.url, size))
+        if self.digest is None:
+            return
+        h = hashlib.new(self.algorithm)
+        with open(self.partial, 'rb') as f:
+            for data in iter(lambda: f.read(1 << 20), b''):
+                h.update(data)
+        if h.hexdigest() != self.digest.lower():
+            # The chunks on disk cannot be trusted; start over next time
+            os.remove(self.partial)
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+            raise DownloadError('The {} digest of {} is {}, expected {}'
+                                .format(self.algorithm, self.url,
+                                        h.hexdigest(), self.digest))
+
+    def load_state(self, size, validator):
+        """
+        Load the record of the chunks already fetched, unless the file
+        changed, or the chunks are not the same size
+        """
+        state = {'url': self.url, 'size': size, 'validator': validator,
+                 'chunk_size': self.chunk_size, 'done': []}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                saved = json.load(f)
+            if all(saved.get(k) == v for k, v in state.items() if k != 'done'):
+                state['done'] = saved.get('done', [])
+        return state
+
+    def save_state(self, state):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
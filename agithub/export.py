@@ -0,0 +1,327 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Bulk export of paginated listings to NDJSON, Arrow IPC or Parquet files.
+
+The items are written as they arrive, in row groups of a fixed number of
+rows, so a listing of any length is exported in bounded memory. Fetching
+runs in a background thread, so that the next pages are on their way
+while a row group is being written.
+
+Arrow IPC and Parquet need pyarrow (pip install agithub[arrow]); NDJSON
+does not.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.export import export
+>>> g = GitHub(token='...')
+>>> status, issues = g.repos.octocat.hello.issues.get(
+...     state='all', paginate=True, stream=True)
+>>> export(issues, 'issues.parquet', row_group_size=10000)
+123456
+"""
+import gzip
+import json
+import logging
+import queue
+import threading
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+formats = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'ndjson',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+    '.parquet': 'parquet',
+}
+
+
+def export(items, path, format=None, row_group_size=10000, queue_size=2,
+           **options):
+    """
+    Write items (an iterable of dicts, e.g. a streamed, paginated listing)
+    to path, and return the number of items written.
+
+    format is one of 'ndjson', 'arrow' or 'parquet', and defaults to the
+    one named by path's extension (ignoring a trailing .gz). At most
+    queue_size row groups of row_group_size items are held waiting to be
+    written. The remaining arguments are passed to the writer.
+
+    If writing fails, fetching stops, and items is closed (if it can be),
+    which closes the connection of a streamed listing.
+    """
+    writer = open_writer(path, format, **options)
+    batches = queue.Queue(queue_size)
+    failure = []
+    stop = threading.Event()
+    items = iter(items)
+
+    def fetch():
+        try:
+            batch = []
+            for item in items:
+                if stop.is_set():
+                    break
+                batch.append(item)
+                if len(batch) >= row_group_size:
+                    batches.put(batch)
+                    batch = []
+            if batch and not stop.is_set():
+                batches.put(batch)
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            if stop.is_set() and hasattr(items, 'close'):
+                items.close()
+            batches.put(None)
+
+    fetcher = threading.Thread(target=fetch)
+    fetcher.daemon = True
+    fetcher.start()
+    count = 0
+    try:
+        with writer:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                writer.write_batch(batch)
+                count += len(batch)
+    except BaseException:
+        stop.set()
+        # Make room for the fetcher, should it be waiting to queue a batch
+        while fetcher.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        raise
+    fetcher.join()
+    if failure:
+        raise failure[0]
+    return count
+
+
+def open_writer(path, format=None, **options):
+    if format is None:
+        name = path[:-3] if path.endswith('.gz') else path
+        extension = name[name.rfind('.'):].lower()
+        if extension not in formats:
+            raise ValueError(
+                'Cannot tell the export format of {}; pass format='
+                .format(path))
+        format = formats[extension]
+    if format == 'ndjson':
+        return NDJSONWriter(path, **options)
+    elif format in ('arrow', 'parquet'):
+        return ArrowWriter(path, format, **options)
+    raise ValueError('Unknown export format: {}'.format(format))
+
+
+def flatten(item, separator='.', prefix=''):
+    """
+    Flatten nested objects into a single dict of scalars, joining the
+    keys with separator, e.g. {'user': {'login': 'a'}} becomes
+    {'user.login': 'a'}. Arrays are kept as JSON strings.
+    """
+    flat = {}
+    for key, value in item.items():
+        key = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, separator, key + separator))
+        elif isinstance(value, list):
+            flat[key] = json.dumps(value, sort_keys=True)
+        else:
+            flat[key] = value
+    return flat
+
+
+class Writer(object):
+    def write_batch(self, items):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NDJSONWriter(Writer):
+    """
+    Writes one JSON document per line, gzipped if the path ends in .gz.
+    With flatten=True, nested objects are flattened (see flatten()).
+    """
+    def __init__(self, path, flatten=False, separator='.'):
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+        self.flatten = flatten
+        self.separator = separator
+
+    def write_batch(self, items):
+        lines = []
+        for item in items:
+            if self.flatten:
+                item = flatten(item, self.separator)
+            lines.append(json.dumps(item, separators=(',', ':')))
+            lines.append('\n')
+        self.file.write(''.join(lines))
+
+    def close(self):
+        self.file.close()
+
+
+class Schema(object):
+    """
+    The columns of a columnar export, and their types: 'bool', 'int',
+    'float' or 'str'. They are inferred from the first row group, as a
+    columnar file's schema cannot change once it has been started.
+
+    types gives the types of any columns not to be inferred, e.g.
+    {'id': 'str'} for a column which holds numbers in the first row group
+    but may hold strings later.
+
+    In later row groups, ints are widened in float columns and any value
+    is written as JSON in str columns. Other values which do not fit
+    their column are written as nulls, with a warning. Columns which were
+    not in the first row group are dropped, with a warning.
+    """
+    def __init__(self, rows, types=None):
+        self.types = {}
+        for row in rows:
+            for name, value in row.items():
+                self.types[name] = self.widen(
+                    self.types.get(name), self.type_of(value))
+        self.types.update(types or {})
+        self.columns = sorted(self.types)
+        for name in self.columns:
+            # A column of nothing but nulls is exported as strings
+            self.types[name] = self.types[name] or 'str'
+        self.dropped = set()
+        self.mismatched = set()
+
+    @staticmethod
+    def type_of(value):
+        if value is None:
+            return None
+        for t in (bool, int, float):
+            if isinstance(value, t):
+                return t.__name__
+        return 'str'
+
+    @staticmethod
+    def widen(a, b):
+        if a is None or a == b:
+            return b
+        if b is None:
+            return a
+        if set((a, b)) == set(('int', 'float')):
+            return 'float'
+        return 'str'
+
+    def column(self, rows, name):
+        t = self.types[name]
+        values = []
+        for row in rows:
+            value = row.get(name)
+            actual = self.type_of(value)
+            if actual is None or actual == t:
+                pass
+            elif t == 'float' and actual == 'int':
+                value = float(value)
+            elif t == 'str':
+                value = json.dumps(value)
+            else:
+                if name not in self.mismatched:
+                    logger.warning(
+                        'Writing nulls for the values of column {} which are '
+                        'not of type {}, such as {!r}; pass its type in '
+                        'types= to keep them'.format(name, t, value))
+                    self.mismatched.add(name)
+                value = None
+            values.append(value)
+        return values
+
+    def check(self, rows):
+        for row in rows:
+            for name in row:
+                if name not in self.types and name not in self.dropped:
+                    logger.warning(
+                        'Dropping column {}, which was not in the first '
+                        'row group'.format(name))
+                    self.dropped.add(name)
+
+
+class ArrowWriter(Writer):
+    """
+    Writes an Arrow IPC (format='arrow') or Parquet (format='parquet')
+    file, one row group per batch. The items are flattened (see
+    flatten()), and the schema is inferred from the first batch, except
+    for the column types given in types (see Schema).
+    """
+    arrow_types = {
+        'bool': 'bool_',
+        'int': 'int64',
+        'float': 'float64',
+        'str': 'string',
+    }
+
+    def __init__(self, path, format='parquet', separator='.',
+                 compression='snappy', types=None):
+        if pyarrow is None:
+            raise ImportError(
+                'Exporting to {} needs pyarrow, which is not installed'
+                .format(format))
+        self.path = path
+        self.format = format
+        self.separator = separator
+        self.compression = compression
+        self.types = types
+        self.schema = None
+        self.writer = None
+
+    def write_batch(self, items):
+        rows = [flatten(item, self.separator) for item in items]
+        if self.schema is None:
+            self.schema = Schema(rows, self.types)
+            self.open()
+        self.schema.check(rows)
+        table = pyarrow.Table.from_pydict(
+            dict((name, self.schema.column(rows, name))
+                 for name in self.schema.columns),
+            schema=self.arrow_schema)
+        if self.format == 'parquet':
+            self.writer.write_table(table, row_group_size=len(rows))
+        else:
+            self.writer.write_table(table)
+
+    def open(self):
+        self.arrow_schema = pyarrow.schema([
+            (name, getattr(pyarrow, self.arrow_types[t])())
+            for name, t in sorted(self.schema.types.items())])
+        if self.format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(
+                self.path, self.arrow_schema, compression=self.compression)
+        else:
+            self.writer = pyarrow.ipc.new_file(self.path, self.arrow_schema)
+
+    def close(self):
+        if self.writer is None:
+            # Nothing was exported; still write a valid, empty file
+            self.schema = Schema([], self.types)
+            self.open()
+        self.writer.close()
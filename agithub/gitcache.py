@@ -0,0 +1,189 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+A permanent cache for git objects fetched from GitHub.
+
+A git blob, tree or commit never changes for a given SHA, so once it has
+been fetched it can be kept forever, without ever being revalidated.
+Give a GitObjectCache to GitHub as object_cache=, and GET requests for
+
+    /repos/:owner/:repo/git/blobs/:sha
+    /repos/:owner/:repo/git/trees/:sha
+    /repos/:owner/:repo/git/commits/:sha
+    /repos/:owner/:repo/commits/:sha
+
+are answered from the cache when possible, without touching the network.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.gitcache import GitObjectCache, fetch_tree_blobs
+>>> g = GitHub(token='...', object_cache=GitObjectCache('~/.cache/git'))
+>>> blobs = fetch_tree_blobs(g, 'octocat', 'hello', tree_sha)
+
+Objects are keyed by their SHA (and the url parameters and Accept header
+of the request), not by repository: forks share their entries. Note that
+the urls inside an entry point to the repository it was first fetched
+from.
+"""
+import base64
+import collections
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from agithub.base import IncompleteRequest
+
+_object_url = re.compile(
+    r'/repos/[^/]+/[^/]+/(git/blobs|git/trees|git/commits|commits)/'
+    r'([0-9a-fA-F]{40})(?:\?(.*))?$')
+
+
+class GitObjectError(TypeError):
+    """
+    A git object (a tree or a blob) could not be fetched. (A TypeError, as
+    failures of GitHub requests were before.)
+    """
+    def __init__(self, sha, status, data):
+        super(GitObjectError, self).__init__(
+            'Failed to fetch git object {}, status {}: {}'.format(
+                sha, status, data))
+        self.sha = sha
+        self.status = status
+        self.data = data
+
+
+class GitObjectCache(object):
+    """
+    Keeps git objects in memory (the max_memory most recently used) and,
+    if path is given, in files under that directory.
+
+    The objects are copied on the way in and out of memory, so that
+    callers which modify what they got do not change the cached object.
+    """
+    def __init__(self, path=None, max_memory=1024):
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.max_memory = max_memory
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, url, headers):
+        """
+        Return the cache key for a GET of url with headers, or None if
+        the url is not one of an immutable git object
+        """
+        match = _object_url.search(url)
+        if match is None:
+            return None
+        kind, sha, query = match.groups()
+        variant = '%s\n%s' % (query or '', headers.get('accept', ''))
+        digest = hashlib.sha1(variant.encode('utf-8')).hexdigest()[:12]
+        return '%s-%s-%s' % (sha.lower(), kind.replace('/', '-'), digest)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory[key] = self.memory.pop(key)
+                return copy.deepcopy(self.memory[key])
+        if self.path is None:
+            return None
+        try:
+            with open(self.filename(key)) as f:
+                data = self.decode(json.load(f))
+        except (IOError, OSError, ValueError):
+            return None
+        self.remember(key, copy.deepcopy(data))
+        return data
+
+    def set(self, key, data):
+        self.remember(key, copy.deepcopy(data))
+        if self.path is None:
+            return
+        filename = self.filename(key)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write to a temporary file first, so that readers never see a
+        # partial entry
+        tmp_filename = '%s.%d.tmp' % (
+            filename, threading.current_thread().ident)
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.encode(data), f)
+        os.replace(tmp_filename, filename)
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.memory:
+                return True
+        return self.path is not None and os.path.exists(self.filename(key))
+
+    def remember(self, key, data):
+        with self.lock:
+            self.memory.pop(key, None)
+            self.memory[key] = data
+            while len(self.memory) > self.max_memory:
+                self.memory.popitem(last=False)
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.json')
+
+    # Raw (bytes) bodies, e.g. of blobs fetched with the raw media type,
+    # are stored base64 encoded
+
+    def encode(self, data):
+        if isinstance(data, bytes):
+            return {'base64': base64.b64encode(data).decode('ascii')}
+        return {'json': data}
+
+    def decode(self, entry):
+        if 'base64' in entry:
+            return base64.b64decode(entry['base64'].encode('ascii'))
+        return entry['json']
+
+
+def fetch_tree_blobs(github, owner, repo, tree_sha, workers=8):
+    """
+    Return {path: blob} for every blob in the tree tree_sha of
+    owner/repo, and in its subtrees. Blobs which are not in the client's
+    object cache yet are fetched, workers at a time.
+    """
+    client = github.client
+    status, tree = github.repos[owner][repo].git.trees[tree_sha].get(
+        recursive=1)
+    if status != 200:
+        raise GitObjectError(tree_sha, status, tree)
+    if tree.get('truncated'):
+        entries = _walk_tree(github, owner, repo, tree_sha, '')
+    else:
+        entries = tree['tree']
+    blobs = [(e['path'], e['sha']) for e in entries if e['type'] == 'blob']
+
+    def fetch(blob_sha):
+        request = IncompleteRequest(client.for_thread())
+        status, blob = request.repos[owner][repo].git.blobs[blob_sha].get()
+        if status != 200:
+            raise GitObjectError(blob_sha, status, blob)
+        return blob
+
+    shas = list(set(sha for path, sha in blobs))
+    with ThreadPoolExecutor(workers) as pool:
+        fetched = dict(zip(shas, pool.map(fetch, shas)))
+    return dict((path, fetched[sha]) for path, sha in blobs)
+
+
+def _walk_tree(github, owner, repo, tree_sha, prefix):
+    # GitHub truncates large recursive trees, so walk them one level at a
+    # time instead
+    status, tree = github.repos[owner][repo].git.trees[tree_sha].get()
+    if status != 200:
+        raise GitObjectError(tree_sha, status, tree)
+    entries = []
+    for entry in tree['tree']:
+        entry = dict(entry, path=prefix + entry['path'])
+        entries.append(entry)
+        if entry['type'] == 'tree':
+            entries.extend(_walk_tree(
+                github, owner, repo, entry['sha'], entry['path'] + '/'))
+    return entries
@@ -0,0 +1,150 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Adaptive concurrency limits for clients used from many threads.
+
+An AdaptiveLimiter caps the number of requests in flight, and finds the
+cap by itself, in the manner of TCP congestion control (AIMD): while
+responses come back throttle-free and as fast as usual, the limit grows
+by about one each round trip; on a throttling response, or when latency
+rises well above its baseline, it is cut by a factor.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.limiter import AdaptiveLimiter
+>>> limiter = AdaptiveLimiter(initial=4, maximum=32)
+>>> g = GitHub(token='...', limiter=limiter)
+>>> ... # use g, or copies of its client, from many threads
+>>> limiter.metrics()
+{'limit': 11, 'in_flight': 9, 'latency': 0.21, 'baseline': 0.18, ...}
+"""
+import threading
+import time
+
+from agithub.base import DeadlineExceeded
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits the requests in flight to limit, which moves between minimum
+    and maximum.
+
+    A response is taken as throttling if its status is 429, or if it
+    asks to Retry-After (as GitHub's secondary rate limits do, with a
+    403). A request which fails with an exception (e.g. a timeout or a
+    reset connection) counts as throttled too. Then, the limit is
+    multiplied by backoff, at most once per round trip.
+
+    The latency of the responses (the time until their headers are in)
+    is smoothed (by smoothing, the weight of each new response), and
+    compared with a baseline, a long-term average which gives each
+    response a tenth of that weight (or, for the first responses, the
+    plain average of them all). Cheap and costly responses (e.g.
+    304s and full pages) are then averaged in both, and only a shift of
+    the latency, as when a queue builds up at the server, takes the
+    smoothed latency past tolerance times the baseline. Then, the limit
+    is cut likewise.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=64, backoff=0.5,
+                 tolerance=2.0, smoothing=0.2):
+        self._limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.measured = 0
+        self.last_cut = 0
+        self.requests = 0
+        self.throttled = 0
+        self.condition = threading.Condition()
+        self.clock = time.monotonic
+
+    @property
+    def limit(self):
+        """The number of requests currently allowed in flight"""
+        return int(self._limit)
+
+    def acquire(self, deadline=None):
+        """
+        Wait for room for another request in flight, and return a token to
+        pass to release() once its response is in
+        """
+        with self.condition:
+            while self.in_flight >= self.limit:
+                if deadline is not None:
+                    remaining = deadline.remaining()
+                    if remaining <= 0:
+                        raise DeadlineExceeded(
+                            'No room for another request in flight before '
+                            'the deadline')
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+        return self.clock()
+
+    def release(self, started, status=None, headers=None):
+        """
+        Record the response to a request, with its status and headers, or
+        status=None if the request failed
+        """
+        now = self.clock()
+        latency = now - started
+        headers = dict((k.lower(), v) for k, v in headers or [])
+        with self.condition:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            self.requests += 1
+
+            if status is None or status == 429 or 'retry-after' in headers:
+                self.throttled += 1
+                self.cut(now)
+            else:
+                self.measure(latency)
+                if self.latency > self.tolerance * self.baseline:
+                    self.cut(now)
+                elif in_flight * 2 >= self.limit:
+                    # The limit is in use (rather than the callers being
+                    # too few to need it): probe for more, by about one
+                    # per round trip
+                    self._limit = min(self._limit + 1.0 / self._limit,
+                                      self.maximum)
+            self.condition.notify_all()
+
+    def measure(self, latency):
+        # Must be called with self.condition held
+        self.measured += 1
+        if self.latency is None:
+            self.latency = self.baseline = latency
+            return
+        self.latency += self.smoothing * (latency - self.latency)
+        weight = max(self.smoothing / 10, 1.0 / self.measured)
+        self.baseline += weight * (latency - self.baseline)
+
+    def cut(self, now):
+        # Must be called with self.condition held. The responses to the
+        # requests in flight when the limit was cut carry the same news,
+        # so only cut once per round trip.
+        if now - self.last_cut < (self.latency or 0):
+            return
+        self.last_cut = now
+        self._limit = max(self._limit * self.backoff, self.minimum)
+
+    def metrics(self):
+        """
+        Return the current limit, requests in flight, smoothed and
+        baseline latencies (in seconds), and the numbers of requests and
+        of throttled requests so far
+        """
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'latency': self.latency,
+                'baseline': self.baseline,
+                'requests': self.requests,
+                'throttled': self.throttled,
+            }
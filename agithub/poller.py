@@ -0,0 +1,206 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Watch GitHub event feeds (/events, /repos/:owner/:repo/events,
+/notifications, ...) for new events.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.poller import Poller
+>>> g = GitHub(token='...')
+>>> poller = Poller(g)
+>>> poller.watch(g.repos.octocat.hello.events, print)
+>>> poller.start(workers=4)
+
+Each feed is polled as often as GitHub's X-Poll-Interval header allows,
+with If-None-Match, so that polls which find nothing new are answered
+with a 304 which does not count against the rate limit. When there is
+something new, pages are only fetched until an event which was already
+delivered turns up. Any number of feeds share the same few worker
+threads.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from agithub.base import PageLimit
+
+logger = logging.getLogger(__name__)
+
+
+class Feed(object):
+    """
+    A watched feed, and what is known about it from the last poll
+    """
+    def __init__(self, url, callback, interval):
+        self.url = url
+        self.callback = callback
+        self.interval = interval
+        self.etag = None
+        # The ids of the events on the newest page seen, or None if the
+        # feed has not been polled yet
+        self.seen = None
+        self.active = True
+
+    def poll(self, client):
+        """
+        Fetch the events which arrived since the last poll, deliver them
+        to the callback, oldest first, and return them, newest first.
+
+        What the poll learnt (the ETag and the events seen) is only kept
+        once every page has been fetched and every event delivered: if
+        anything fails, the next poll asks for the same events again.
+        """
+        headers = {}
+        if self.etag is not None:
+            headers['if-none-match'] = self.etag
+        status, data = client.request_page('GET', self.url, None, headers)
+
+        interval = client.getheader('X-Poll-Interval')
+        if interval is not None:
+            self.interval = int(interval)
+        if status == 304:
+            return []
+        if status != 200 or type(data) is not list:
+            logger.warning(
+                'Polling GitHub feed {} failed with status {}: {}'.format(
+                    self.url, status, data))
+            return []
+        etag = client.getheader('ETag')
+        newest = set(event.get('id') for event in data)
+
+        seen = self.seen
+        if seen is None:
+            events = data
+        else:
+            limit = PageLimit(
+                stop_when=lambda event: event.get('id') in seen)
+            events = [event for event in data if limit.keep(event)]
+            for page_status, page in client.iter_next_pages(
+                    'GET', self.url, data, limit=limit):
+                events.extend(page)
+
+        for event in reversed(events):
+            self.callback(event)
+        self.etag, self.seen = etag, newest
+        return events
+
+
+class Poller(object):
+    """
+    Schedules the polling of any number of feeds. Either call poll_due()
+    from your own loop, or start() worker threads which poll each feed
+    whenever it is due, until stop() is called.
+
+    interval is the number of seconds between polls of a feed until
+    GitHub says otherwise.
+    """
+    def __init__(self, github, interval=60):
+        self.client = github.client
+        self.interval = interval
+        self.schedule = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.running = False
+
+    def watch(self, request, callback, **params):
+        """
+        Poll the feed at request (an IncompleteRequest, e.g.
+        g.repos.octocat.hello.events), with the given url parameters.
+        callback is called with each new event, oldest first. Returns
+        the Feed, which can be passed to unwatch.
+        """
+        url = request.url + self.client.urlencode(params)
+        feed = Feed(url, callback, self.interval)
+        self._schedule(feed, time.time())
+        return feed
+
+    def unwatch(self, feed):
+        feed.active = False
+
+    def poll(self, feed, client=None):
+        """
+        Poll feed now, and deliver its new events to its callback
+        """
+        return feed.poll(client or self.client)
+
+    def poll_due(self):
+        """
+        Poll each feed which is due, in the calling thread. Returns the
+        number of seconds until the next feed is due, or None if there
+        are no feeds.
+        """
+        while True:
+            with self.condition:
+                feed, wait = self._pop_due()
+            if feed is None:
+                return wait
+            self._poll_and_reschedule(feed, self.client)
+
+    def start(self, workers=4):
+        """
+        Start polling from workers threads, in the background
+        """
+        with self.condition:
+            self.running = True
+        for n in range(workers):
+            thread = threading.Thread(
+                target=self._work, name='agithub-poller-%d' % n)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the worker threads, and wait for them to finish their polls
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _work(self):
+        client = self.client.for_thread()
+        while True:
+            with self.condition:
+                feed, wait = self._pop_due()
+                while feed is None and self.running:
+                    self.condition.wait(wait)
+                    feed, wait = self._pop_due()
+                if not self.running:
+                    if feed is not None:
+                        self._push(feed, time.time())
+                    return
+            self._poll_and_reschedule(feed, client)
+
+    def _poll_and_reschedule(self, feed, client):
+        try:
+            self.poll(feed, client)
+        except Exception:
+            logger.exception('Polling GitHub feed {} failed'.format(feed.url))
+        self._schedule(feed, time.time() + feed.interval)
+
+    def _schedule(self, feed, due):
+        with self.condition:
+            self._push(feed, due)
+            self.condition.notify()
+
+    def _push(self, feed, due):
+        heapq.heappush(self.schedule, (due, next(self.counter), feed))
+
+    def _pop_due(self):
+        # Must be called with self.condition held
+        while self.schedule:
+            due, n, feed = self.schedule[0]
+            if not feed.active:
+                heapq.heappop(self.schedule)
+            elif due <= time.time():
+                heapq.heappop(self.schedule)
+                return feed, 0
+            else:
+                return None, due - time.time()
+        return None, None
@@ -0,0 +1,133 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Priority lanes for GitHub clients which share one rate limit.
+
+When interactive requests and background crawls are made with the same
+credentials, a crawl can spend the whole hourly quota, leaving the
+interactive requests to wait for it to be reset. PriorityLanes keeps a
+share of the quota for the higher priority lanes: a request in a lower
+priority lane waits, once the remaining quota falls to its floor, until
+the quota is reset.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.priority import PriorityLanes
+>>> lanes = PriorityLanes()
+>>> dashboard = GitHub(token='...', priority_lanes=lanes, priority='high')
+>>> crawler = GitHub(token='...', priority_lanes=lanes, priority='low')
+>>> lanes.report()
+{'high': {'requests': 12, 'mean_wait': 0.0, ...}, 'low': {...}}
+"""
+import threading
+import time
+
+from agithub.base import DeadlineExceeded
+
+
+class LaneStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.waited = 0.0
+        self.latency = 0.0
+        self.first = None
+        self.last = None
+
+    def report(self):
+        requests = self.requests or 1
+        elapsed = (self.last - self.first) if self.requests > 1 else 0
+        return {
+            'requests': self.requests,
+            'mean_wait': self.waited / requests,
+            'mean_latency': self.latency / requests,
+            'throughput': (self.requests / elapsed) if elapsed else None,
+        }
+
+
+class PriorityLanes(object):
+    """
+    floors maps each lane's name to the share of the rate limit (0 to 1)
+    it must leave for the others: a request in the lane is held back
+    while no more than that share of the quota remains. By default, the
+    'low' lane leaves a fifth of the quota to the 'high' lane, which may
+    spend all of it.
+
+    The quota is tracked from the X-RateLimit headers of the responses to
+    all the clients sharing the lanes (for the 'core' resource), and
+    counted down as requests are sent in between.
+    """
+    def __init__(self, floors=None):
+        self.floors = floors or {'high': 0.0, 'low': 0.2}
+        self.stats = dict((lane, LaneStats()) for lane in self.floors)
+        self.condition = threading.Condition()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.clock = time.time
+
+    def enter(self, lane, deadline=None):
+        """
+        Wait until a request in lane may be sent, and count it as sent.
+        Returns a token to pass to leave() once the response is in.
+        """
+        floor = self.floors[lane]
+        arrived = self.clock()
+        with self.condition:
+            while not self._may_send(floor):
+                if self.reset is None:
+                    # Until a response tells when the quota is reset
+                    wait = 1
+                else:
+                    wait = max(self.reset - self.clock(), 0) + 1
+                if deadline is not None and deadline.remaining() < wait:
+                    raise DeadlineExceeded(
+                        'The GitHub ratelimit left for the {} priority lane '
+                        'is not replenished until after the deadline'
+                        .format(lane))
+                self.condition.wait(wait)
+            if self.remaining is not None:
+                self.remaining -= 1
+        return arrived, self.clock()
+
+    def leave(self, lane, token, headers):
+        """
+        Record a response to a request in lane, and the quota it tells of
+        """
+        arrived, sent = token
+        now = self.clock()
+        headers = dict((k.lower(), v) for k, v in headers or [])
+        with self.condition:
+            stats = self.stats.setdefault(lane, LaneStats())
+            stats.requests += 1
+            stats.waited += sent - arrived
+            stats.latency += now - sent
+            if stats.first is None:
+                stats.first = sent
+            stats.last = now
+
+            if (headers.get('x-ratelimit-resource', 'core') == 'core'
+                    and 'x-ratelimit-remaining' in headers):
+                self.limit = int(headers.get('x-ratelimit-limit', 0)) or None
+                self.remaining = int(headers['x-ratelimit-remaining'])
+                self.reset = int(headers.get('x-ratelimit-reset', 0))
+                self.condition.notify_all()
+
+    def report(self):
+        """
+        Return the number of requests, mean time spent waiting to be sent
+        and mean latency once sent (in seconds), and throughput (requests
+        per second) of each lane
+        """
+        with self.condition:
+            return dict((lane, stats.report())
+                        for lane, stats in self.stats.items())
+
+    def _may_send(self, floor):
+        # Must be called with self.condition held
+        if floor <= 0 or self.limit is None or self.remaining is None:
+            return True
+        if self.reset is not None and self.clock() >= self.reset:
+            # The quota has been reset since it was last heard of; count
+            # down from the full limit until a response tells more
+            self.remaining = self.limit
+            self.reset = None
+        return self.remaining > floor * self.limit
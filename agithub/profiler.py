@@ -0,0 +1,200 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Attribute the GitHub rate limit spent to endpoints and to the code which
+made the requests.
+
+Give a QuotaProfiler to a GitHub object as profiler=, and every request
+is recorded with its endpoint (the url with ids and names collapsed, as
+in /repos/:owner/:repo/issues/:number), the quota it cost (the change in
+X-RateLimit-Used), whether it was answered from a cache, its size, and
+the call site which made it.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.profiler import QuotaProfiler
+>>> profiler = QuotaProfiler()
+>>> g = GitHub(token='...', profiler=profiler)
+>>> ...
+>>> for row in profiler.report(by='endpoint'):
+...     print(row['cost'], row['requests'], row['key'])
+"""
+import collections
+import os
+import re
+import sys
+import threading
+
+from agithub.base import urlsplit
+
+# Path segments which are followed by names, and how those are shown.
+# Segments at the start of the path are looked up in TOP_LEVEL; the others
+# in NESTED. Ids and SHAs are collapsed wherever they are.
+TOP_LEVEL = {
+    'repos': (':owner', ':repo'),
+    'users': (':user',),
+    'orgs': (':org',),
+    'gists': (':gist_id',),
+    'enterprises': (':enterprise',),
+}
+NESTED = {
+    'branches': (':branch',),
+    'labels': (':name',),
+    'collaborators': (':user',),
+    'members': (':user',),
+    'memberships': (':user',),
+    'following': (':user',),
+    'teams': (':team_slug',),
+    'commits': (':ref',),
+    'environments': (':environment',),
+    'topics': (':topic',),
+}
+# Segments followed by a path or ref of any length
+REST_OF_PATH = {
+    'contents': ':path',
+    'refs': ':ref',
+    'ref': ':ref',
+    'compare': ':basehead',
+    'tarball': ':ref',
+    'zipball': ':ref',
+}
+
+Record = collections.namedtuple(
+    'Record', 'method endpoint status cost outcome bytes site stack')
+
+
+def endpoint(url):
+    """
+    Return the template of a GitHub url, e.g. /repos/:owner/:repo/pulls
+    for /repos/octocat/hello/pulls?state=all
+    """
+    segments = urlsplit(url).path.strip('/').split('/')
+    template = []
+    i = 0
+    while i < len(segments):
+        segment = segments[i]
+        template.append(segment)
+        i += 1
+        if segment in REST_OF_PATH and i < len(segments):
+            template.append(REST_OF_PATH[segment])
+            break
+        table = TOP_LEVEL if i == 1 else NESTED
+        for name in table.get(segment, ()):
+            if i < len(segments):
+                template.append(name)
+                i += 1
+    for n, segment in enumerate(template):
+        if segment.isdigit():
+            template[n] = ':id'
+        elif re.match(r'^[0-9a-f]{40}$', segment):
+            template[n] = ':sha'
+    return '/' + '/'.join(template)
+
+
+class QuotaProfiler(object):
+    """
+    Records the quota spent by the requests of any number of clients.
+
+    The cost of a request is the change in X-RateLimit-Used since the last
+    response for the same rate limit resource (core, search, graphql,
+    ...). Where that is not known, e.g. for the first response, it is
+    counted as 1, or 0 for a 304, which GitHub does not charge. With
+    several processes sharing a token, their spend shows up in the
+    deltas too.
+
+    depth is the number of frames of the caller's stack kept per request.
+    Frames of the modules named in internal, and of their submodules, are
+    skipped, so that the stack starts at the code which made the request.
+
+    The spend is added up per endpoint, call site and stack as requests
+    are recorded, so that a long-running process does not keep every
+    request; only the last keep of them are kept as records.
+    """
+    def __init__(self, depth=5, keep=1000, internal=('agithub',)):
+        self.depth = depth
+        self.internal = tuple(internal)
+        self.records = collections.deque(maxlen=keep)
+        self.totals = dict((by, {}) for by in ('endpoint', 'site', 'stack'))
+        self.used = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, url, status, headers, size, outcome):
+        """
+        Record a request. outcome is 'fetched', 'not-modified' (a 304
+        answer to a conditional request) or 'cached' (answered without a
+        request, e.g. from an object cache).
+        """
+        headers = dict((k.lower(), v) for k, v in headers or [])
+        stack = self.stack()
+        with self.lock:
+            cost = self.cost(status, headers, outcome)
+            record = Record(
+                method, endpoint(url), status, cost, outcome, size,
+                stack[0] if stack else None, stack)
+            self.records.append(record)
+            for by, rows in self.totals.items():
+                self.add(rows, by, record)
+
+    def add(self, rows, by, record):
+        # Must be called with self.lock held
+        key = getattr(record, by)
+        if by == 'endpoint':
+            key = '{} {}'.format(record.method, key)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {
+                'key': key, 'requests': 0, 'cost': 0, 'cached': 0,
+                'bytes': 0, 'statuses': collections.Counter()}
+        row['requests'] += 1
+        row['cost'] += record.cost
+        row['cached'] += record.outcome != 'fetched'
+        row['bytes'] += record.bytes or 0
+        row['statuses'][record.status] += 1
+
+    def cost(self, status, headers, outcome):
+        # Must be called with self.lock held
+        if outcome == 'cached':
+            return 0
+        default = 0 if status == 304 else 1
+        if 'x-ratelimit-used' not in headers:
+            return default
+        resource = headers.get('x-ratelimit-resource', 'core')
+        used = int(headers['x-ratelimit-used'])
+        reset = headers.get('x-ratelimit-reset')
+        last = self.used.get(resource)
+        self.used[resource] = (reset, used)
+        if last is None or last[0] != reset:
+            # A new window: all that was used in it may be ours, or not
+            return min(used, default)
+        return max(used - last[1], 0)
+
+    def stack(self):
+        """
+        Return the caller's frames, outside of agithub, as 'file:line in
+        function' strings, innermost first
+        """
+        frames = []
+        frame = sys._getframe(1)
+        while frame is not None and len(frames) < self.depth:
+            module = frame.f_globals.get('__name__', '')
+            internal = any(module == name or module.startswith(name + '.')
+                           for name in self.internal)
+            if not internal:
+                code = frame.f_code
+                frames.append('{}:{} in {}'.format(
+                    os.path.basename(code.co_filename), frame.f_lineno,
+                    code.co_name))
+            frame = frame.f_back
+        return tuple(frames)
+
+    def report(self, by='endpoint', top=None):
+        """
+        Return the spend per endpoint (by='endpoint'), per call site
+        (by='site') or per full stack (by='stack'), highest cost first, as
+        dicts of: key, requests, cost, cached (requests answered from a
+        cache or with a 304), bytes and statuses (requests per status).
+        """
+        with self.lock:
+            rows = [dict(row, statuses=collections.Counter(row['statuses']))
+                    for row in self.totals[by].values()]
+        rows.sort(key=lambda row: (-row['cost'], -row['requests']))
+        return rows[:top] if top else rows
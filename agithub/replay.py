@@ -0,0 +1,213 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Record the traffic of a client to a file, and replay it later without a
+network.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.replay import Recorder, Replay
+>>> with Recorder('crawl.jsonl.gz') as recorder:
+...     g = GitHub(token='...', transport=recorder)
+...     crawl(g)
+
+>>> replay = Replay('crawl.jsonl.gz', latency=1.0)
+>>> g = GitHub(transport=replay)
+>>> crawl(g)    # Same responses, same timing, no network
+
+Recordings hold one exchange per line, as JSON: the request's method,
+url, headers and body, and the response's status, headers, body and the
+time it took. Bodies are base64 encoded. A path ending in .gz is gzipped.
+The authorization header is never recorded.
+"""
+import base64
+import gzip
+import json
+import threading
+import time
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't')
+    return open(path, mode)
+
+
+def _encode(body):
+    if body is None:
+        return None
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    return base64.b64encode(body).decode('ascii')
+
+
+def _decode(body):
+    if body is None:
+        return None
+    return base64.b64decode(body.encode('ascii'))
+
+
+class RecordedResponse(object):
+    """
+    Stands in for an HTTPResponse, serving a body held in memory
+    """
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = [tuple(header) for header in headers]
+        self.body = body
+        self.offset = 0
+
+    def read(self, amt=None):
+        end = len(self.body) if amt is None else self.offset + amt
+        data = self.body[self.offset:end]
+        self.offset += len(data)
+        return data
+
+    read1 = read
+
+    def getheader(self, name, default=None):
+        for key, value in self.headers:
+            if key.lower() == name.lower():
+                return value
+        return default
+
+    def getheaders(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+
+class RecordingConnection(object):
+    """
+    Wraps a real connection, recording each exchange made through it
+    """
+    def __init__(self, conn, recorder, host):
+        self.conn = conn
+        self.recorder = recorder
+        self.host = host
+        self.exchange = None
+
+    def request(self, method, url, body=None, headers=None):
+        headers = dict(headers or {})
+        self.conn.request(method, url, body, headers)
+        headers.pop('authorization', None)
+        self.exchange = {
+            'host': self.host,
+            'method': method,
+            'url': url,
+            'request_headers': headers,
+            'request_body': _encode(body),
+        }
+        self.started = time.time()
+
+    def getresponse(self):
+        response = self.conn.getresponse()
+        body = response.read()
+        self.exchange.update({
+            'status': response.status,
+            'reason': response.reason,
+            'headers': response.getheaders(),
+            'body': _encode(body),
+            'elapsed': round(time.time() - self.started, 6),
+        })
+        self.recorder.record(self.exchange)
+        return RecordedResponse(
+            response.status, response.reason, response.getheaders(), body)
+
+    def close(self):
+        self.conn.close()
+
+
+class Recorder(object):
+    """
+    A transport which makes requests over the network as usual, and
+    appends each exchange to the recording at path. Pass it to a client
+    as transport=. Close it (or use it as a context manager) when done.
+    """
+    def __init__(self, path):
+        self.file = _open(path, 'a')
+        self.lock = threading.Lock()
+
+    def get_connection(self, client, timeouts=(None, None)):
+        return RecordingConnection(
+            client.open_connection(timeouts), self, client.prop.api_url)
+
+    def record(self, exchange):
+        line = json.dumps(exchange, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayConnection(object):
+    def __init__(self, replay, host):
+        self.replay = replay
+        self.host = host
+        self.exchange = None
+
+    def request(self, method, url, body=None, headers=None):
+        self.exchange = self.replay.find(self.host, method, url)
+
+    def getresponse(self):
+        exchange = self.exchange
+        if self.replay.latency:
+            time.sleep(exchange.get('elapsed', 0) * self.replay.latency)
+        return RecordedResponse(
+            exchange['status'], exchange.get('reason', ''),
+            exchange['headers'], _decode(exchange['body']))
+
+    def close(self):
+        pass
+
+
+class Replay(object):
+    """
+    A transport which answers requests from the recording at path,
+    without touching the network. Any number of clients, in any number
+    of threads, may share one Replay.
+
+    Requests are matched on host, method and url. When a request was
+    recorded several times, the recorded responses are served in turn,
+    starting over once they run out. A request which was never recorded
+    raises LookupError.
+
+    latency scales the time each recorded exchange took: None (or 0)
+    answers immediately, 1.0 at the recorded pace, 0.5 twice as fast.
+    """
+    def __init__(self, path, latency=None):
+        self.latency = latency
+        self.exchanges = {}
+        self.served = {}
+        self.lock = threading.Lock()
+        with _open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    self.add(json.loads(line))
+
+    def add(self, exchange):
+        key = (exchange.get('host'), exchange['method'], exchange['url'])
+        self.exchanges.setdefault(key, []).append(exchange)
+
+    def find(self, host, method, url):
+        key = (host, method, url)
+        with self.lock:
+            exchanges = self.exchanges.get(key)
+            if not exchanges:
+                raise LookupError(
+                    'No recorded response for %s %s%s' % (method, host, url))
+            n = self.served.get(key, 0)
+            self.served[key] = n + 1
+        return exchanges[n % len(exchanges)]
+
+    def get_connection(self, client, timeouts=(None, None)):
+        return ReplayConnection(self, client.prop.api_url)
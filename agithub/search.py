@@ -0,0 +1,210 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Complete result sets for GitHub searches, beyond the 1000 results the
+search API returns for any one query.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.search import PartitionedSearch
+>>> g = GitHub(token='...')
+>>> search = PartitionedSearch(g.search.issues, 'repo:octocat/hello is:pr')
+>>> prs = search.run()
+
+The query is run once to learn its total_count. If that is over the cap,
+the query is split in two, on disjoint ranges of a qualifier (created:,
+by default), and each half is treated the same way, until every part fits
+under the cap. Only then are the parts' results fetched, and merged
+without duplicates.
+"""
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Qualifiers which take dates; the others (size:, stars:, ...) take numbers
+DATE_QUALIFIERS = (
+    'created', 'updated', 'pushed', 'merged', 'closed', 'authored-date',
+    'committer-date')
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+class SearchError(TypeError):
+    """
+    A page of search results could not be fetched. (A TypeError, as
+    failures of GitHub requests were before.)
+    """
+    def __init__(self, status, data):
+        super(SearchError, self).__init__(
+            'Failed to fetch a page of GitHub search results, '
+            'status {}: {}'.format(status, data))
+        self.status = status
+        self.data = data
+
+
+class PartitionedSearch(object):
+    """
+    Run the search q at request (e.g. g.search.issues), with the given
+    extra url parameters, splitting it on qualifier as needed to get
+    every result.
+
+    start and end bound the qualifier's range. They default to GitHub's
+    beginnings until now for dates (given as datetimes), and to 0 until
+    10**9 for numbers.
+
+    Up to workers queries run at once. Keep it low: the search API has a
+    small rate limit of its own. The workers share what they learn of it
+    (see SearchRateLimit), and all wait for it to be replenished whenever
+    it runs out.
+
+    key returns the identity of a result, to drop duplicates; results
+    can move between ranges while the search runs (e.g. on updated:).
+
+    After run(), truncated lists the ranges which still had more results
+    than the cap but could not be split further.
+    """
+    max_results = 1000
+
+    def __init__(self, request, q, qualifier='created', start=None,
+                 end=None, workers=2, key=None, **params):
+        self.request = request
+        self.q = q
+        self.qualifier = qualifier
+        self.dates = qualifier in DATE_QUALIFIERS
+        if self.dates:
+            self.start = start or datetime.datetime(2007, 10, 1)
+            self.end = end or datetime.datetime.now(
+                datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+            self.step = datetime.timedelta(seconds=1)
+        else:
+            self.start = start or 0
+            self.end = end if end is not None else 10 ** 9
+            self.step = 1
+        self.workers = workers
+        self.key = key or (lambda item: item.get('id') or item.get('url'))
+        params.setdefault('per_page', 100)
+        self.params = params
+        self.truncated = []
+        self.ratelimit = SearchRateLimit()
+
+    def run(self):
+        """
+        Return the results of the search
+        """
+        results = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending = set([pool.submit(self.fetch, self.start, self.end)])
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end, items = future.result()
+                    if items is None:
+                        for half in self.split(start, end):
+                            pending.add(pool.submit(self.fetch, *half))
+                        continue
+                    for item in items:
+                        results.setdefault(self.key(item), item)
+        return list(results.values())
+
+    def split(self, start, end):
+        if self.dates:
+            seconds = int((end - start).total_seconds())
+            middle = start + datetime.timedelta(seconds=seconds // 2)
+        else:
+            middle = start + (end - start) // 2
+        return (start, middle), (middle + self.step, end)
+
+    def query(self, start, end):
+        if self.dates:
+            start, end = start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)
+        return '%s %s:%s..%s' % (self.q, self.qualifier, start, end)
+
+    def fetch(self, start, end):
+        """
+        Fetch the results of the query on the range start..end. If there
+        are too many of them and the range can be split, only look at the
+        first page, and return None for the results.
+        """
+        client = self.request.client.for_thread()
+        params = dict(self.params, q=self.query(start, end))
+        url = self.request.url + client.urlencode(params)
+        status, data = self._get_page(client, url)
+        if status != 200 or not isinstance(data, dict):
+            raise SearchError(status, data)
+
+        total = data.get('total_count', 0)
+        if total > self.max_results:
+            if end > start:
+                logger.debug('Splitting GitHub search {}, with {} results'
+                             .format(params['q'], total))
+                return start, end, None
+            self.truncated.append((start, end))
+            logger.warning('GitHub search {} has {} results, but cannot be '
+                           'split further'.format(params['q'], total))
+
+        items = list(data.get('items', []))
+        url = client.get_next_link_url()
+        while url:
+            status, data = self._get_page(client, url)
+            if status != 200 or not isinstance(data, dict):
+                raise SearchError(status, data)
+            items.extend(data.get('items', []))
+            url = client.get_next_link_url()
+        return start, end, items
+
+    def _get_page(self, client, url):
+        self.ratelimit.acquire()
+        status, data = client.request_page('GET', url, None, {})
+        self.ratelimit.update(client)
+        return status, data
+
+
+class SearchRateLimit(object):
+    """
+    The search rate limit, as told by the X-RateLimit-* headers of the
+    responses to all the workers of a search. acquire() is called before
+    each request, and holds the worker while no requests remain, until
+    the limit is reset; update(client) after each one.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.reset = None
+        self.clock = time.time
+        self.sleep = time.sleep
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                if self.reset is not None and now >= self.reset:
+                    self.remaining = self.reset = None
+                if self.remaining is None:
+                    return
+                if self.remaining > 0:
+                    # Count the request now, as the responses to those
+                    # already in flight will not tell of it
+                    self.remaining -= 1
+                    return
+                wait = self.reset - now + 1
+            logger.debug('No GitHub search ratelimit remaining. Sleeping '
+                         'for {} seconds'.format(int(wait)))
+            self.sleep(wait)
+
+    def update(self, client):
+        if client.getheader('X-RateLimit-Resource', 'search') != 'search':
+            return
+        remaining = client.getheader('X-RateLimit-Remaining')
+        reset = client.getheader('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        remaining, reset = int(remaining), int(reset)
+        with self.lock:
+            if self.reset is None or reset > self.reset:
+                self.remaining, self.reset = remaining, reset
+            elif reset == self.reset:
+                # Responses can arrive out of order; the lowest count is
+                # the latest
+                self.remaining = min(self.remaining, remaining)
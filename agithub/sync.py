@@ -0,0 +1,174 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Incremental, resumable listing of GitHub resources.
+
+Sync remembers, per listing, how far the last run got, so that the next
+run only asks GitHub for what changed since then:
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.sync import Sync, CheckpointStore
+>>> g = GitHub(token='...')
+>>> sync = Sync(CheckpointStore('checkpoints.json'))
+>>> for issue in sync.items(g.repos.octocat.hello.issues, state='all'):
+...     save(issue)
+"""
+import email.utils
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SyncError(Exception):
+    """
+    A page of a listing could not be fetched. The checkpoint still points
+    at that page, so the next run resumes there.
+    """
+    def __init__(self, status, data):
+        super(SyncError, self).__init__(
+            'Failed to fetch a page of a synced GitHub listing, '
+            'status {}: {}'.format(status, data))
+        self.status = status
+        self.data = data
+
+
+class CheckpointStore(object):
+    """
+    Keeps a checkpoint (a JSON-serializable dict) per listing. With a
+    path, the checkpoints are written through to that JSON file;
+    otherwise, they only live as long as the object.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.checkpoints = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.checkpoints = json.load(f)
+
+    def get(self, key):
+        return dict(self.checkpoints.get(key, {}))
+
+    def set(self, key, checkpoint):
+        self.checkpoints[key] = checkpoint
+        if self.path is None:
+            return
+        # Write to a temporary file first, so that a crash cannot leave a
+        # truncated checkpoint file behind
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checkpoints, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class Sync(object):
+    """
+    Fetch only the items of a GitHub listing which changed since the last
+    run, one page at a time.
+
+    For each listing, the checkpoint records:
+    * since: the high-water mark of the `timestamp` of the items seen,
+      which is sent as the `since` url parameter on the next run. It is
+      capped at `started`, so that items which change while a run pages
+      through the listing are fetched again by the next one;
+    * started: when the current run started, as told by the Date header
+      of its first page;
+    * url, etag: the first page's url and ETag; when the url is unchanged
+      the next run sends If-None-Match, and an unchanged listing costs a
+      single 304 response, which GitHub does not count against the rate
+      limit;
+    * next_url: while a run is in progress, the first page not yet
+      consumed. A run which crashed resumes from there.
+
+    Listings which do not support `since` (e.g. events) are synced by
+    passing since=None; they still benefit from the ETag.
+
+    `timestamp` is the item key holding the time it was last changed, or
+    a function from the item to that time.
+    """
+    def __init__(self, store=None, since='since', timestamp='updated_at'):
+        self.store = store if store is not None else CheckpointStore()
+        self.since = since
+        if callable(timestamp):
+            self.timestamp = timestamp
+        else:
+            self.timestamp = lambda item: item.get(timestamp)
+
+    def items(self, request, key=None, **params):
+        """
+        Yield the changed items of the listing at `request` (an
+        IncompleteRequest, e.g. g.repos.octocat.hello.issues). The
+        remaining arguments are url parameters. `key` names the
+        checkpoint, and defaults to the request's path.
+
+        The checkpoint is advanced once all the items of a page have been
+        consumed, so stopping early replays the current page next time.
+        """
+        client = request.client
+        key = key or request.url
+        checkpoint = self.store.get(key)
+        headers = {}
+
+        if checkpoint.get('next_url'):
+            url = checkpoint['next_url']
+            logger.debug('Resuming sync of {} at {}'.format(key, url))
+        else:
+            if self.since and checkpoint.get('since'):
+                params[self.since] = checkpoint['since']
+            url = request.url + client.urlencode(params)
+            if checkpoint.get('etag') and checkpoint.get('url') == url:
+                headers['if-none-match'] = checkpoint['etag']
+            checkpoint['url'] = url
+            checkpoint['etag'] = None
+            checkpoint['pending_since'] = checkpoint.get('since')
+
+        while url:
+            status, data = client.request_page('GET', url, None, dict(headers))
+            if status == 304:
+                logger.debug('Sync of {} is up to date'.format(key))
+                return
+            if status != 200 or type(data) is not list:
+                raise SyncError(status, data)
+            if url == checkpoint['url']:
+                checkpoint['etag'] = client.getheader('ETag')
+                checkpoint['started'] = self._started(client)
+            headers = {}
+            url = client.get_next_link_url()
+
+            for item in data:
+                yield item
+                checkpoint['pending_since'] = self._later(
+                    checkpoint['pending_since'], self.timestamp(item))
+
+            checkpoint['next_url'] = url or None
+            if not url:
+                checkpoint['since'] = self._earlier(
+                    checkpoint['pending_since'], checkpoint.get('started'))
+            self.store.set(key, checkpoint)
+
+    def _started(self, client):
+        # Prefer GitHub's clock to ours, as it is the one `since` refers to
+        date = client.getheader('Date')
+        started = email.utils.parsedate_tz(date) if date else None
+        if started is None:
+            started = time.gmtime()
+        else:
+            started = time.gmtime(email.utils.mktime_tz(started))
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', started)
+
+    def _earlier(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return min(a, b)
+
+    def _later(self, a, b):
+        # GitHub timestamps are ISO 8601 in UTC, so compare as strings
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return max(a, b)
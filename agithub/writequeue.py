@@ -0,0 +1,236 @@
+# Copyright 2012-2016 Jonathan Paugh and contributors
+# See COPYING for license details
+"""
+Bulk GitHub mutations which keep under GitHub's secondary rate limits.
+
+GitHub limits the rate at which content may be created and changed, on
+top of the hourly request quota, and answers writes which go too fast
+with a 403 (or 429) carrying Retry-After. WriteQueue spaces writes out to
+stay under those limits, merges writes which would be made redundant by
+a later one, and backs off when GitHub pushes back anyway.
+
+>>> from agithub.GitHub import GitHub
+>>> from agithub.writequeue import WriteQueue
+>>> g = GitHub(token='...')
+>>> queue = WriteQueue(g)
+>>> for number in issues:
+...     queue.post(g.repos.octocat.hello.issues[number].labels,
+...                body=['triaged'])
+>>> writes = queue.run()
+>>> [w.status for w in writes]
+[200, 200, ...]
+"""
+import collections
+import logging
+import threading
+import time
+
+from agithub.base import parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+
+class Write(object):
+    """
+    A queued mutation. Once it has been made, status and data hold the
+    response, and done is set. If the request raised instead (e.g. the
+    connection was reset), error holds the exception, and status is
+    'failed'.
+    """
+    def __init__(self, method, url, body):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.attempts = 0
+        # How many writes were merged into this one
+        self.merged = 0
+        self.status = None
+        self.data = None
+        self.error = None
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return '<Write %s %s: %s>' % (self.method, self.url, self.status)
+
+
+class WriteQueue(object):
+    """
+    Queue up writes with post(), put(), patch() and delete(), which take
+    an IncompleteRequest followed by the same arguments as the client's
+    methods, then make them all with run().
+
+    Writes are spaced at least interval seconds apart, and no more than
+    per_minute and per_hour are made in any minute or hour. After a
+    secondary rate limit response, all writes pause for Retry-After (or an
+    exponential backoff from backoff seconds), the spacing between writes
+    doubles, and the write is retried up to max_retries times. Each
+    successful write then shrinks the spacing back towards interval.
+
+    While a PATCH, PUT or DELETE is still queued, a later write of the
+    same method to the same url is merged into it: PATCH bodies are
+    combined, the last PUT body wins, and repeated DELETEs collapse. A
+    DELETE also cancels any queued PATCH or PUT of its url.
+    """
+    mergeable = ('PATCH', 'PUT', 'DELETE')
+
+    def __init__(self, github, per_minute=80, per_hour=500, interval=1.0,
+                 concurrency=1, backoff=60, max_interval=60, max_retries=5):
+        self.client = github.client
+        self.per_minute = per_minute
+        self.per_hour = per_hour
+        self.min_interval = self.interval = interval
+        self.max_interval = max_interval
+        self.concurrency = concurrency
+        self.backoff = backoff
+        self.max_retries = max_retries
+        self.clock = time.time
+        self.sleep = time.sleep
+
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.queued = {}
+        self.sent = collections.deque()
+        self.last_sent = None
+        self.paused_until = 0
+
+    def post(self, request, body=None, **params):
+        return self.add('POST', request, body, **params)
+
+    def put(self, request, body=None, **params):
+        return self.add('PUT', request, body, **params)
+
+    def patch(self, request, body=None, **params):
+        return self.add('PATCH', request, body, **params)
+
+    def delete(self, request, **params):
+        return self.add('DELETE', request, None, **params)
+
+    def add(self, method, request, body=None, **params):
+        """
+        Queue a write of body to request (an IncompleteRequest) with the
+        given url parameters. Returns the Write, which may be one queued
+        earlier that this one was merged into.
+        """
+        url = request.url + self.client.urlencode(params)
+        with self.lock:
+            if method == 'DELETE':
+                for other in ('PATCH', 'PUT'):
+                    superseded = self.queued.pop((other, url), None)
+                    if superseded is not None:
+                        self.pending.remove(superseded)
+                        superseded.status = 'superseded'
+                        superseded.done.set()
+
+            write = self.queued.get((method, url))
+            if write is not None:
+                write.merged += 1
+                if method == 'PATCH' and isinstance(write.body, dict) \
+                        and isinstance(body, dict):
+                    write.body.update(body)
+                elif method == 'PUT':
+                    write.body = body
+                return write
+
+            write = Write(method, url, body)
+            if method == 'PATCH' and isinstance(body, dict):
+                write.body = dict(body)
+            if method in self.mergeable:
+                self.queued[(method, url)] = write
+            self.pending.append(write)
+            return write
+
+    def run(self):
+        """
+        Make the queued writes, returning them in the order they finished.
+        A write which fails with an exception does not stop the others;
+        it is returned with its error.
+        """
+        self.finished = []
+        threads = []
+        for n in range(self.concurrency):
+            thread = threading.Thread(
+                target=self._work, args=(self.client.for_thread(),),
+                name='agithub-writequeue-%d' % n)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return self.finished
+
+    def _work(self, client):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                write = self.pending.popleft()
+                if self.queued.get((write.method, write.url)) is write:
+                    del self.queued[(write.method, write.url)]
+            self._wait_for_slot()
+            self._send(client, write)
+
+    def _wait_for_slot(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                while self.sent and self.sent[0] <= now - 3600:
+                    self.sent.popleft()
+                wait = self.paused_until - now
+                if self.last_sent is not None:
+                    wait = max(wait, self.last_sent + self.interval - now)
+                if len(self.sent) >= self.per_hour:
+                    wait = max(wait, self.sent[-self.per_hour] + 3600 - now)
+                recent = [t for t in self.sent if t > now - 60]
+                if len(recent) >= self.per_minute:
+                    wait = max(wait, recent[-self.per_minute] + 60 - now)
+                if wait <= 0:
+                    self.sent.append(now)
+                    self.last_sent = now
+                    return
+            self.sleep(wait)
+
+    def _send(self, client, write):
+        write.attempts += 1
+        try:
+            status, data = client.request_page(
+                write.method, write.url, write.body, {})
+        except Exception as e:
+            # Writes are not idempotent in general, so this is not retried
+            logger.warning('{} {} failed: {!r}'.format(
+                write.method, write.url, e))
+            write.error = e
+            self._finish(write, 'failed', None)
+            return
+        retry_after = client.getheader('Retry-After')
+        if (self.is_secondary_ratelimit(status, data, retry_after)
+                and write.attempts <= self.max_retries):
+            delay = parse_retry_after(retry_after, self.clock())
+            if delay is None:
+                delay = self.backoff * 2 ** (write.attempts - 1)
+            logger.debug(
+                'Hit a GitHub secondary ratelimit; pausing writes for {} '
+                'seconds'.format(delay))
+            with self.lock:
+                self.paused_until = max(
+                    self.paused_until, self.clock() + delay)
+                self.interval = min(self.interval * 2, self.max_interval)
+                self.pending.appendleft(write)
+            return
+
+        with self.lock:
+            self.interval = max(self.min_interval, self.interval * 0.9)
+        self._finish(write, status, data)
+
+    def _finish(self, write, status, data):
+        write.status, write.data = status, data
+        with self.lock:
+            self.finished.append(write)
+        write.done.set()
+
+    def is_secondary_ratelimit(self, status, data, retry_after):
+        if status not in (403, 429):
+            return False
+        if retry_after is not None:
+            return True
+        message = data.get('message', '') if isinstance(data, dict) else ''
+        message = message.lower()
+        return 'secondary rate limit' in message or 'abuse' in message
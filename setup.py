@@ -29,4 +29,7 @@ setup(name='agithub',
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
       include_package_data=True,
       zip_safe=False,
+      extras_require={
+          'arrow': ['pyarrow'],
+      },
       )